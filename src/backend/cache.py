@@ -0,0 +1,365 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Digests of recently hashed files, keyed by (path, mtime, size) so unchanged files are only read once
+_digest_memo: OrderedDict[tuple, str] = OrderedDict()
+_digest_memo_lock = threading.Lock()
+DIGEST_MEMO_MAX = 4096
+
+
+def file_digest(filepath: Path | str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Get a SHA-256 digest of a file's contents.
+
+    Args:
+        filepath: Path of the file to hash
+        chunk_size: Number of bytes to read at a time
+
+    Returns:
+        Hex digest of the file contents
+    """
+    filepath = Path(filepath)
+    stat = filepath.stat()
+    memo_key = (str(filepath), stat.st_mtime_ns, stat.st_size)
+
+    with _digest_memo_lock:
+        if memo_key in _digest_memo:
+            _digest_memo.move_to_end(memo_key)
+            return _digest_memo[memo_key]
+
+    sha = hashlib.sha256()
+    with filepath.open('rb') as f:
+        while chunk := f.read(chunk_size):
+            sha.update(chunk)
+
+    digest = sha.hexdigest()
+
+    with _digest_memo_lock:
+        _digest_memo[memo_key] = digest
+
+        # Every rewrite of a session file adds a key, so drop the least recently used
+        while len(_digest_memo) > DIGEST_MEMO_MAX:
+            _digest_memo.popitem(last=False)
+
+    return digest
+
+
+def make_key(*parts) -> str:
+    """
+    Build a cache key from any JSON-serialisable parts (dict keys are sorted, so key order doesn't matter).
+
+    Returns:
+        Hex digest identifying the parts
+    """
+    normalised = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(normalised.encode()).hexdigest()
+
+
+def link_or_copy(src: Path, dest: Path):
+    """
+    Place a file at dest, hardlinking where possible and copying otherwise.
+
+    The new file is swapped in with an atomic rename, so an existing file at dest
+    is replaced rather than written into (which would also change any hardlinks to it).
+    """
+    # Already linked (renaming over a link to the same file is a no-op that would leave the temp file behind)
+    if dest.exists() and os.path.samefile(src, dest):
+        return
+
+    tmp_path = dest.with_name(f'.{dest.name}.{uuid.uuid4().hex}.tmp')
+
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+
+    os.replace(tmp_path, dest)
+
+
+class FileCache:
+    """
+    Content-addressed file cache on disk with a size budget and LRU eviction.
+
+    Cached files are hardlinked into session directories, so their own mtimes are left alone
+    (data caches elsewhere are keyed by them). Each use touches a hidden '.used' file beside it instead.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, suffix: str = ''):
+        """
+        Initialize file cache.
+
+        Args:
+            cache_dir: Directory to store cached files in
+            max_bytes: Disk budget, least recently used files are evicted beyond this
+            suffix: File extension given to cached files, e.g. '.wav'
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        """Get the path a cached file is stored under."""
+        return self.cache_dir / f'{key}{self.suffix}'
+
+    def used_marker(self, cached: Path) -> Path:
+        """Get the path of the file whose mtime records when a cached file was last used."""
+        return cached.with_name(f'.{cached.name}.used')
+
+    def mark_used(self, cached: Path):
+        """Mark a cached file as recently used for LRU eviction."""
+        self.used_marker(cached).touch()
+
+    def last_used(self, cached: Path, stat: os.stat_result) -> float:
+        try:
+            return max(stat.st_mtime, self.used_marker(cached).stat().st_mtime)
+        except FileNotFoundError:
+            return stat.st_mtime
+
+    def fetch(self, key: str, dest: Path) -> bool:
+        """
+        Place the cached file for key at dest, if there is one.
+
+        Args:
+            key: Cache key
+            dest: Path to link (or copy) the cached file to
+
+        Returns:
+            True on a cache hit, False on a miss
+        """
+        cached = self.path_for(key)
+
+        try:
+            link_or_copy(cached, dest)
+        except FileNotFoundError:
+            # Never cached, or evicted by another worker in the meantime
+            with self._lock:
+                self.misses += 1
+            return False
+
+        self.mark_used(cached)
+
+        with self._lock:
+            self.hits += 1
+
+        return True
+
+    def lookup(self, key: str) -> Path | None:
+        """
+        Get the path of the cached file for key, for reading in place.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Path of the cached file, or None on a miss
+        """
+        cached = self.path_for(key)
+
+        if not cached.exists():
+            with self._lock:
+                self.misses += 1
+            return None
+
+        self.mark_used(cached)
+
+        with self._lock:
+            self.hits += 1
+
+        return cached
+
+    def store(self, key: str, src: Path) -> Path:
+        """
+        Add a file to the cache and evict old entries if over budget.
+
+        Args:
+            key: Cache key
+            src: Path of the file to cache
+
+        Returns:
+            Path of the cached file
+        """
+        cached = self.path_for(key)
+        link_or_copy(src, cached)
+        self.mark_used(cached)
+        self.evict()
+
+        return cached
+
+    def entries(self) -> list[tuple[Path, os.stat_result]]:
+        """
+        Get all cached files with their stats.
+
+        Returns:
+            List of (path, stat) tuples sorted by last use (oldest first)
+        """
+        entries = []
+        for item in self.cache_dir.iterdir():
+            if item.name.startswith('.'):
+                continue
+            try:
+                entries.append((item, item.stat()))
+            except FileNotFoundError:
+                continue
+
+        entries.sort(key=lambda x: self.last_used(*x))
+        return entries
+
+    def evict(self) -> int:
+        """
+        Remove least recently used files until the cache is within budget.
+
+        Returns:
+            Number of files evicted
+        """
+        entries = self.entries()
+        total = sum(stat.st_size for _, stat in entries)
+        evicted = 0
+
+        for path, stat in entries:
+            if total <= self.max_bytes:
+                break
+
+            path.unlink(missing_ok=True)
+            self.used_marker(path).unlink(missing_ok=True)
+            total -= stat.st_size
+            evicted += 1
+
+        if evicted:
+            logger.info(f"Evicted {evicted} files from {self.cache_dir.name} cache")
+            with self._lock:
+                self.evictions += evicted
+
+        return evicted
+
+    def stats(self) -> dict:
+        """
+        Get cache usage and hit/miss counters (counters are per process).
+
+        Returns:
+            Dict of cache statistics
+        """
+        entries = self.entries()
+        lookups = self.hits + self.misses
+
+        return {
+            "entries": len(entries),
+            "size_mb": round(sum(stat.st_size for _, stat in entries) / (1024**2), 2),
+            "max_mb": round(self.max_bytes / (1024**2), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions
+        }
+
+
+class MemoryCache:
+    """In-memory LRU cache of objects within a size budget, shared by every request in a process."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float | None = None):
+        """
+        Initialize memory cache.
+
+        Args:
+            max_bytes: Memory budget, least recently used objects are evicted beyond this
+            ttl_seconds: How long objects stay valid after being added, or None to keep them until evicted
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._items: OrderedDict[object, tuple[object, int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the cached object for key.
+
+        Returns:
+            The cached object, or None on a miss
+        """
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+
+            value, nbytes, expires = self._items[key]
+
+            if time.monotonic() > expires:
+                del self._items[key]
+                self.size -= nbytes
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(self, key, value, nbytes: int):
+        """
+        Add an object to the cache, evicting the least recently used objects if over budget.
+
+        Args:
+            key: Any hashable cache key
+            value: Object to cache, which must not be modified afterwards
+            nbytes: Approximate memory used by the object
+        """
+        # Objects bigger than the whole budget would only evict everything else
+        if nbytes > self.max_bytes:
+            return
+
+        expires = time.monotonic() + self.ttl_seconds if self.ttl_seconds else float('inf')
+
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+
+            self._items[key] = (value, nbytes, expires)
+            self.size += nbytes
+
+            while self.size > self.max_bytes:
+                _, (_, evicted_bytes, _) = self._items.popitem(last=False)
+                self.size -= evicted_bytes
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Get cache usage and hit/miss counters.
+
+        Returns:
+            Dict of cache statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "entries": len(self._items),
+                "size_mb": round(self.size / (1024**2), 2),
+                "max_mb": round(self.max_bytes / (1024**2), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions
+            }
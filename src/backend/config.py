@@ -1,4 +1,29 @@
+import os
+
 # File for maintaining constants, such that they only need to be changed here for the rest of the code to still work.
 
 GITHUB_USER = 'gcaselton'
-GITHUB_REPO = 'sonification-toolkit'
\ No newline at end of file
+GITHUB_REPO = 'sonification-toolkit'
+
+# Number of API worker processes (uvicorn's --workers), each of which has its own job pool
+API_WORKERS = max(int(os.environ.get('WEB_CONCURRENCY', 1)), 1)
+
+# Number of processes each API worker uses to render sonification jobs
+# (defaults to its share of the CPU cores, up to 4, as each process loads strauss, lightkurve and pandas)
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 0)) or min(max((os.cpu_count() or 1) // API_WORKERS, 1), 4)
+
+# MAST file download endpoint, overridable so downloads can be pointed at a local stand-in
+MAST_DOWNLOAD_URL = os.environ.get('MAST_DOWNLOAD_URL', 'https://mast.stsci.edu/api/v0.1/Download/file')
+
+# Limits on each file downloaded from MAST
+DOWNLOAD_TIMEOUT_SECONDS = float(os.environ.get('DOWNLOAD_TIMEOUT_SECONDS', 60))
+DOWNLOAD_MAX_MB = int(os.environ.get('DOWNLOAD_MAX_MB', 200))
+
+# Background downloads of light curve search results, at most this many per search,
+# and at most this many at once per session and across all sessions
+PREFETCH_MAX_RESULTS = int(os.environ.get('PREFETCH_MAX_RESULTS', 5))
+PREFETCH_SESSION_CONCURRENCY = int(os.environ.get('PREFETCH_SESSION_CONCURRENCY', 2))
+PREFETCH_GLOBAL_CONCURRENCY = int(os.environ.get('PREFETCH_GLOBAL_CONCURRENCY', 8))
+
+# Whether plots that only depend on the built-in data (e.g. constellations) are also cached on disk, for all workers to share
+PLOT_DISK_CACHE = os.environ.get('PLOT_DISK_CACHE', '1') != '0'
@@ -2,9 +2,9 @@ from fastapi import APIRouter, HTTPException
 
 from pydantic import BaseModel
 from pathlib import Path
-from paths import TMP_DIR, STYLE_FILES_DIR, SUGGESTED_DATA_DIR
+from paths import TMP_DIR, STYLE_FILES_DIR, SUGGESTED_DATA_DIR, CACHE_DIR
 from context import session_id_var
-import logging, base64, uuid, gc
+import logging, base64, uuid, gc, threading
 
 import numpy as np
 import pandas as pd
@@ -12,24 +12,54 @@ import matplotlib
 matplotlib.use("Agg") 
 from matplotlib.figure import Figure
 from matplotlib.colors import Normalize
+from matplotlib.collections import LineCollection
 from io import BytesIO
 from utils import resolve_file
 from request_models import DataRequest, NStarsRequest, ConstellationRequest
 from skyfield.data import stellarium
 from skyfield.api import load
+from star_catalog import get_catalog
+from cache import FileCache, MemoryCache, make_key
+from config import PLOT_DISK_CACHE
 router = APIRouter(prefix='/constellations')
 
 CATEGORY = 'constellations'
 
 STYLES_DIR = STYLE_FILES_DIR / CATEGORY
 SUGGESTED_DIR = SUGGESTED_DATA_DIR / CATEGORY
-HYG_DATA = SUGGESTED_DIR / 'hyg.csv'
+
+# Plots from /get-and-plot/ (as base64 SVG), keyed by what they're plotted from,
+# in each worker's memory and (if PLOT_DISK_CACHE) on disk, shared by all workers and kept between restarts
+PLOT_CACHE_VERSION = 1
+
+PLOT_MEMORY_CACHE = MemoryCache(max_bytes=64 * 1024 * 1024)
+
+PLOT_CACHE = FileCache(
+    cache_dir=CACHE_DIR / 'constellation_plots',
+    max_bytes=256 * 1024 * 1024,
+    suffix='.svg'
+)
+
+# Number of stars the refine menu starts with, which are plotted ahead of time
+DEFAULT_N_STARS = 100
 
 # Parse constellation line data into a dictionary
 line_data = SUGGESTED_DIR / 'constellationship.fab'
 with load.open(str(line_data)) as f:
     CONST_SHAPES = dict(stellarium.parse_constellations(f))
 
+# Stars in each constellation's shape
+CONST_STARS = {const: sorted({hip for edge in edges for hip in edge}) for const, edges in CONST_SHAPES.items()}
+
+# Edges each star starts, as (constellation, other star), to find a plotted constellation from only the stars in the plot
+EDGES_FROM = {}
+for const, edges in CONST_SHAPES.items():
+    for hip_a, hip_b in edges:
+        EDGES_FROM.setdefault(hip_a, []).append((const, hip_b))
+
+# Ties go to the constellation parsed first
+CONST_ORDER = {const: i for i, const in enumerate(CONST_SHAPES)}
+
 logging.basicConfig(level=logging.DEBUG)
 LOG = logging.getLogger(__name__)
 
@@ -125,20 +155,127 @@ IAU_names = {
     "Lacerta": "Lac"
 }
 
+class ConstellationStars:
+    """A constellation's stars sorted by brightness, with running extremes so any 'brightest N' is summarised by lookup."""
+
+    def __init__(self, stars_sorted: pd.DataFrame):
+        """
+        Initialize constellation stars.
+
+        Args:
+            stars_sorted: The stars, sorted by magnitude (brightest first), with 'ra_corrected'
+        """
+        self.stars = stars_sorted
+
+        # Sorted ascending, with any NaNs last
+        self.magnitudes = stars_sorted['magnitude'].to_numpy()
+        self.max_magnitudes = np.fmax.accumulate(self.magnitudes)
+
+        # Running min/max of the brightest N stars' positions, for center()
+        ra = stars_sorted['ra'].to_numpy()
+        unwrapped_ra = np.where(ra < 12, ra + 24, ra)
+        dec = stars_sorted['dec'].to_numpy()
+
+        self.ra_min = np.fmin.accumulate(ra)
+        self.ra_max = np.fmax.accumulate(ra)
+        self.unwrapped_ra_min = np.fmin.accumulate(unwrapped_ra)
+        self.unwrapped_ra_max = np.fmax.accumulate(unwrapped_ra)
+        self.dec_min = np.fmin.accumulate(dec)
+        self.dec_max = np.fmax.accumulate(dec)
+
+    def __len__(self) -> int:
+        return len(self.stars)
+
+    def top(self, n: int) -> pd.DataFrame:
+        """Get the n brightest stars."""
+        return self.stars.head(n).copy()
+
+    def max_magnitude(self, n: int) -> float:
+        """Get the faintest magnitude among the n brightest stars."""
+        if n < 1 or len(self) == 0:
+            raise HTTPException(status_code=400, detail='Number of stars must be at least 1.')
+
+        return float(self.max_magnitudes[min(n, len(self)) - 1])
+
+    def count_brighter(self, max_magnitude: float) -> int:
+        """Get the number of stars at or brighter than a magnitude."""
+        return int(np.searchsorted(self.magnitudes, max_magnitude, side='right'))
+
+    def center(self, n: int | None = None) -> tuple[float, float]:
+        """
+        Get the center of the n brightest stars (all of them by default), halfway between their extremes of RA and Dec.
+
+        - Returns: (RA in degrees, Dec)
+        """
+        i = (len(self) if n is None else min(n, len(self))) - 1
+
+        if i < 0:
+            return np.nan, np.nan
+
+        # Unwrap RA if the stars cross the 0h line
+        if self.ra_max[i] - self.ra_min[i] > 12:
+            ra_min, ra_max = self.unwrapped_ra_min[i], self.unwrapped_ra_max[i]
+        else:
+            ra_min, ra_max = self.ra_min[i], self.ra_max[i]
+
+        ra_center = ((ra_min + ra_max) / 2) % 24
+        dec_center = (self.dec_min[i] + self.dec_max[i]) / 2
+
+        # Convert RA from hours to degrees to match expected unit
+        return float(ra_center * 15), float(dec_center)
+
+
+# ConstellationStars of every constellation, by (name, by_shape), built once per catalog
+_constellation_stars: dict[tuple[str, bool], ConstellationStars] = {}
+_constellation_stars_version = None
+_constellation_stars_lock = threading.Lock()
+
+
+def constellation_stars(constellation_name: str, by_shape: bool = True) -> ConstellationStars:
+    """
+    Get a constellation's precomputed stars, building them for every constellation the first time (and when the catalog changes).
+    """
+    global _constellation_stars, _constellation_stars_version
+
+    if constellation_name not in IAU_names:
+        raise HTTPException(status_code=400, detail=f'Constellation "{constellation_name}" not recognised.')
+
+    catalog = get_catalog()
+
+    if _constellation_stars_version != catalog.version:
+        with _constellation_stars_lock:
+            if _constellation_stars_version != catalog.version:
+                _constellation_stars = {
+                    (name, shape): ConstellationStars(get_constellation(name, shape))
+                    for name in IAU_names
+                    for shape in (True, False)
+                }
+                _constellation_stars_version = catalog.version
+
+    return _constellation_stars[(constellation_name, by_shape)]
+
+
+def preload_constellations():
+    """Build every constellation's stars ahead of the first request for them, if the star catalog is there."""
+    try:
+        constellation_stars(next(iter(IAU_names)))
+    except FileNotFoundError:
+        LOG.warning('Star catalog not found, constellations will be unavailable')
+
+
 def get_constellation(constellation_name: str, by_shape: bool = True) -> pd.DataFrame:
 
-    # load CSV
-    df = pd.read_csv(HYG_DATA)
+    # The catalog is only parsed once per process
+    catalog = get_catalog()
 
-    lines = CONST_SHAPES[IAU_names[constellation_name]]
-    star_ids = list(set([n for ns in lines for n in ns]))
+    star_ids = CONST_STARS[IAU_names[constellation_name]]
     
     if by_shape:
         # Filter by membership in CONST_SHAPES dict
-        stars_in_constellation = df[df['hip'].isin(star_ids)].copy()
+        stars_in_constellation = catalog.by_hip(star_ids)
     else:
         #Filter by constellation boundaries
-        stars_in_constellation = df[df['con'] == IAU_names[constellation_name]].copy()
+        stars_in_constellation = catalog.by_constellation(IAU_names[constellation_name])
 
     # sort by brightness (smaller magnitude = brighter)
     stars_sorted = stars_in_constellation.sort_values('magnitude')
@@ -181,22 +318,20 @@ def correct_ra(ra):
 
 def get_const_from_df(df: pd.DataFrame):
 
-    best_const = None
-    best_match_count = 0
-
     star_ids = set(df.index)
 
-    for const, edges in CONST_SHAPES.items():
-        match_count = sum(
-            1 for a, b in edges
-            if a in star_ids and b in star_ids
-        )
+    # Each edge with both of its stars in the data is a vote for its constellation
+    match_counts = {}
 
-        if match_count > best_match_count:
-            best_match_count = match_count
-            best_const = const
+    for hip_a in star_ids:
+        for const, hip_b in EDGES_FROM.get(hip_a, ()):
+            if hip_b in star_ids:
+                match_counts[const] = match_counts.get(const, 0) + 1
 
-    return best_const
+    if not match_counts:
+        return None
+
+    return max(match_counts, key=lambda const: (match_counts[const], -CONST_ORDER[const]))
 
 
 
@@ -248,21 +383,19 @@ def plot_and_format_constellation(df: pd.DataFrame, lines: bool):
         
         print("DF CONST:", df['con'].unique())
 
+        if const is not None:
 
-        for hip_a, hip_b in CONST_SHAPES[const]:
-
-            if hip_a in df.index and hip_b in df.index:
+            # Position of each end of every edge, or -1 if the star isn't plotted
+            first = ~df.index.duplicated()
+            edges = np.array(CONST_SHAPES[const]).reshape(-1, 2)
+            ends = df.index[first].get_indexer(edges.ravel()).reshape(-1, 2)
+            ends = ends[(ends >= 0).all(axis=1)]
 
-                star_a = df.loc[hip_a]
-                star_b = df.loc[hip_b]
+            # Each segment is [[ra_a, dec_a], [ra_b, dec_b]]
+            segments = np.stack((x[first][ends], y[first][ends]), axis=-1)
 
-                ax.plot(
-                    [star_a.ra_corrected, star_b.ra_corrected],
-                    [star_a.dec, star_b.dec],
-                    color="white",
-                    linewidth=1,
-                    zorder=1
-                )
+            # Projecting caps, as ax.plot() would draw each line with
+            ax.add_collection(LineCollection(segments, colors="white", linewidths=1, capstyle="projecting", zorder=1))
 
     # add padding around stars
     padding_ra = ra_range * 0.2
@@ -274,17 +407,19 @@ def plot_and_format_constellation(df: pd.DataFrame, lines: bool):
     ax.invert_xaxis()
 
     # Label stars with proper names if available (using unwrapped RA)
-    for i, row in df.iterrows():
-        if pd.notna(row['proper']) and str(row['proper']).strip() != "":
-            ax.text(
-                row['ra_corrected'] + offset_ra,
-                row['dec'] + offset_dec,
-                row['proper'],
-                color='white',
-                fontsize=8,
-                ha='left',
-                va='bottom'
-            )
+    proper = df['proper']
+    named = (proper.notna() & (proper.astype(str).str.strip() != "")).to_numpy()
+
+    for ra, dec, name in zip(x[named] + offset_ra, y[named] + offset_dec, proper[named]):
+        ax.text(
+            ra,
+            dec,
+            name,
+            color='white',
+            fontsize=8,
+            ha='left',
+            va='bottom'
+        )
 
     # Add labels
     ax.set_xlabel("RA")
@@ -308,77 +443,118 @@ def plot_and_format_constellation(df: pd.DataFrame, lines: bool):
 @router.post("/get-and-plot/")
 async def plot_constellation(request: ConstellationRequest):
 
+    image = constellation_plot(request.name, request.by_shape, request.n_stars)
+
+    return {'image': image}
+
+
+def constellation_plot(name: str, by_shape: bool, n_stars: int) -> str:
+    """
+    Plot a constellation, or get the cached plot if it's been plotted before.
+
+    - **name**: Name of the constellation
+    - **by_shape**: Whether to plot the stars of its shape, or its N brightest stars
+    - **n_stars**: Number of stars to plot if not by shape
+    - Returns: The image as a base64 string
+    """
+
     # select constellation
-    stars_sorted = get_constellation(request.name, by_shape=request.by_shape)
+    stars = constellation_stars(name, by_shape=by_shape)
 
     # choose top N stars if not filtering by shape
-    N = request.n_stars
-    filtered_stars = stars_sorted.head(N).copy() if not request.by_shape else stars_sorted
-
-    # Index by hipparcos ID
-    filtered_stars = filtered_stars.set_index('hip')
+    N = min(n_stars, len(stars)) if not by_shape else len(stars)
 
-    image = plot_and_format_constellation(filtered_stars, lines=request.by_shape)
+    # The plot depends on nothing else, so N is left out of shape plots' keys
+    cache_key = make_key(PLOT_CACHE_VERSION, get_catalog().version, name, by_shape, None if by_shape else N)
 
-    return {'image': image}
+    image = PLOT_MEMORY_CACHE.get(cache_key)
+    if image is not None:
+        return image
 
-@router.post("/get-max-magnitude/")
-async def get_magnitude(request: ConstellationRequest):
-    
-    # get and sort constellation stars
-    stars_sorted = get_constellation(request.name)
+    cached = PLOT_CACHE.lookup(cache_key) if PLOT_DISK_CACHE else None
 
-    # choose top N stars
-    N = request.n_stars
-    top_stars = stars_sorted.head(N).copy()
+    if cached:
+        try:
+            image = base64.b64encode(cached.read_bytes()).decode("utf-8")
+        except FileNotFoundError:
+            # Evicted since the lookup
+            cached = None
 
-    max_magnitude = max(top_stars['magnitude'].tolist())
+    if not cached:
+        filtered_stars = stars.top(N)
 
-    return {'max_magnitude': max_magnitude}
+        # Index by hipparcos ID
+        filtered_stars = filtered_stars.set_index('hip')
 
-@router.post("/get-n-stars/")
-async def get_n_stars(request: NStarsRequest):
+        image = plot_and_format_constellation(filtered_stars, lines=by_shape)
 
-    # sort by brightness (smaller magnitude = brighter)
-    stars_sorted = get_constellation(request.name)
+        if PLOT_DISK_CACHE:
+            tmp_path = PLOT_CACHE.cache_dir / f'.{cache_key}.{uuid.uuid4().hex}.svg'
+            tmp_path.write_bytes(base64.b64decode(image))
+            PLOT_CACHE.store(cache_key, tmp_path)
+            tmp_path.unlink(missing_ok=True)
 
-    # choose stars up to max magnitude
-    max_magnitude = request.max_magnitude
-    selected_stars = stars_sorted[stars_sorted['magnitude'] <= max_magnitude].copy()
+    PLOT_MEMORY_CACHE.put(cache_key, image, len(image))
 
-    n_stars = len(selected_stars)
+    return image
 
-    return {'n_stars': n_stars}
 
-def constellation_center(df):
+def prerender_constellation_plots(stop: threading.Event | None = None):
+    """
+    Plot every constellation, by shape and with the default number of stars, so the first plot of each is instant.
+    Only the disk cache is shared between workers, so without it there is nothing to warm up.
 
-    ra = df["ra"].copy()
-    dec = df["dec"]
+    - **stop**: Set to stop early, e.g. when the server shuts down
+    """
 
-    # unwrap RA if needed
-    if ra.max() - ra.min() > 12:
-        ra[ra < 12] += 24
+    if not PLOT_DISK_CACHE:
+        return
 
-    ra_center = (ra.min() + ra.max()) / 2
-    dec_center = (dec.min() + dec.max()) / 2
+    for name in IAU_names:
+        for by_shape in (True, False):
+            if stop is not None and stop.is_set():
+                return
+            try:
+                constellation_plot(name, by_shape, DEFAULT_N_STARS)
+            except FileNotFoundError:
+                LOG.warning('Star catalog not found, constellations will not be pre-plotted')
+                return
+            except Exception as e:
+                LOG.warning("Could not pre-plot %s: %s", name, e)
 
-    ra_center = ra_center % 24
+@router.post("/get-max-magnitude/")
+async def get_magnitude(request: ConstellationRequest):
     
-    # Convert RA from hours to degrees to match expected unit
-    ra_degs = ra_center*15
+    # get constellation stars, already sorted
+    stars = constellation_stars(request.name)
+
+    # faintest of the top N stars
+    max_magnitude = stars.max_magnitude(request.n_stars)
+
+    return {'max_magnitude': max_magnitude}
+
+@router.post("/get-n-stars/")
+async def get_n_stars(request: NStarsRequest):
+
+    # already sorted by brightness (smaller magnitude = brighter)
+    stars = constellation_stars(request.name)
+
+    # count stars up to max magnitude
+    n_stars = stars.count_brighter(request.max_magnitude)
+
+    return {'n_stars': n_stars}
 
-    return ra_degs, dec_center
 
- 
 @router.post("/save-refined/")
 async def save_refined(request: ConstellationRequest):
 
-    # get and sort constellation stars
-    stars = get_constellation(request.name, request.by_shape)
-    refined_stars = stars.head(request.n_stars).copy() if not request.by_shape else stars
+    # get constellation stars, already sorted
+    stars = constellation_stars(request.name, request.by_shape)
+    n_stars = request.n_stars if not request.by_shape else len(stars)
+    refined_stars = stars.top(n_stars)
     
-    # compute 'center' of constellation for spatial audio
-    ra, dec = constellation_center(refined_stars)
+    # 'center' of constellation for spatial audio
+    ra, dec = stars.center(n_stars)
 
     # save to tmp directory (overwriting any existing dataset)
     session_id = session_id_var.get()
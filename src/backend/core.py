@@ -1,14 +1,20 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Cookie, Response, Request
-from fastapi.responses import FileResponse
-from extensions import sonify
+from fastapi.responses import FileResponse, StreamingResponse
+from extensions import sonify, read_YAML_file
 from pathlib import Path
-from paths import TMP_DIR, STYLE_FILES_DIR, SUGGESTED_DATA_DIR, SAMPLES_DIR, HYG_DATA
-from sounds import all_sounds, online_sounds, local_sounds, asset_cache, format_name
+from paths import TMP_DIR, STYLE_FILES_DIR, SUGGESTED_DATA_DIR, SAMPLES_DIR, HYG_DATA, CACHE_DIR
+from cache import FileCache, file_digest, make_key, link_or_copy
+from jobs import submit_job, read_job, delete_job, QUEUED, DONE, ERROR
+from streaming import begin_stream, end_stream, save_streaming, is_rendering, follow_file, expected_size, STREAMING_CATEGORIES
+from settings import load_settings_from_file
+from dataset import data_info, cache_data_info, summarise
+from night_sky import handle_observer
+from sounds import all_sounds, online_sounds, local_sounds, asset_cache, format_name, sound_registry
 from config import GITHUB_USER, GITHUB_REPO
 from context import session_id_var
 from utils import resolve_file, is_number
 from request_models import DataRequest, SoundRequest, CustomStyleSettings, SonificationRequest
-import logging, httpx, yaml, os, uuid, aiofiles, zipfile, traceback, base64, gc
+import logging, httpx, yaml, os, uuid, aiofiles, zipfile, traceback, base64, gc, shutil, threading
 from param_descriptions import INPUTS, OUTPUTS
 
 import numpy as np
@@ -41,6 +47,26 @@ FORMATTED_FILENAMES = {
 
 MASTER_VOL = 0.5
 
+# Renders shared across sessions, keyed by everything that affects the output audio
+RENDER_CACHE_MAX_MB = 2048
+RENDER_CACHE_VERSION = 1  # Bump when a code change alters rendered audio
+
+RENDER_CACHE = FileCache(
+    cache_dir=CACHE_DIR / 'renders',
+    max_bytes=RENDER_CACHE_MAX_MB * 1024 * 1024,
+    suffix='.wav'
+)
+
+# Style previews, keyed by style content and category
+PREVIEW_CACHE_MAX_MB = 256
+PREVIEW_DURATION = 5
+
+PREVIEW_CACHE = FileCache(
+    cache_dir=CACHE_DIR / 'previews',
+    max_bytes=PREVIEW_CACHE_MAX_MB * 1024 * 1024,
+    suffix='.wav'
+)
+
 
 @router.get('/session/')
 def get_or_create_session(
@@ -76,35 +102,162 @@ def get_session_size(session_dir: str) -> int:
         LOG.warning("Could not calculate session size: %s", e)
         return 0
 
-@router.post('/generate-sonification/')
-def generate_sonification(request: SonificationRequest):
+def normalised_style(style_filepath: Path) -> dict:
+    """
+    Read a style file, keeping only the settings that affect the audio.
+    """
+
+    # Name and description don't change the audio, so renamed copies of a style share renders
+    style = read_YAML_file(style_filepath) or {}
+    return {k: v for k, v in style.items() if k not in ('name', 'description')}
+
+
+def render_cache_key(data_filepath: Path, style_filepath: Path, request: SonificationRequest) -> str:
+    """
+    Build the render cache key for a sonification request.
+
+    :param data_filepath: Resolved path of the data file
+    :param style_filepath: Resolved path of the style file
+    :param request: The sonification request
+
+    :return: Key identifying the rendered audio
+    :rtype: str
+    """
+
+    style = normalised_style(style_filepath)
+
+    # Data resolution and downsampling mode are per-session settings that change how light curves are downsampled
+    settings = load_settings_from_file()
+    downsampling = (settings['data_resolution'], settings['downsampling'])
+
+    return make_key(
+        RENDER_CACHE_VERSION,
+        file_digest(data_filepath),
+        style,
+        request.category,
+        float(request.duration),
+        request.system,
+        request.observer,
+        downsampling
+    )
+
+
+def sonification_path(request: SonificationRequest) -> tuple[Path, str]:
+    """
+    Get where the audio for a sonification request is saved in the session directory.
+
+    :return: The filepath and its file ref
+    :rtype: tuple[Path, str]
+    """
+
+    session_id = session_id_var.get()
+
+    if not session_id:
+        raise HTTPException(status_code=400, detail="No session cookie found")
+    
+    category = FORMATTED_FILENAMES[request.category]
+    ext = '.wav'
+    filename = f'{request.data_name} {category}{ext}'
+    filepath = TMP_DIR / session_id / filename
+    file_ref = f'session:{filename}'
+
+    return filepath, file_ref
+
+
+def render_sonification(request: SonificationRequest) -> dict:
+    """
+    Render a sonification into the session directory, reusing a cached render if there is one.
+    Shared by the '/generate-sonification/' endpoint and render jobs.
+
+    :param request: The sonification request
+
+    :return: The file ref of the rendered audio, and the altitude/azimuth of the target if an observer was given
+    :rtype: dict
+    """
         
     # Resolve data and style file names to actual paths in backend
     data_filepath = resolve_file(request.data_ref)
     style_filepath = resolve_file(request.style_ref)
 
-    if int(request.duration) > 300:
-        raise HTTPException(status_code=400, detail="Sonification too long, maximum length = 5 minutes.")
+    filepath, file_ref = sonification_path(request)
 
-    try:
-        
-        soni, alt_az = sonify(data_filepath, style_filepath, request.category, request.duration, request.system, request.observer)
+    cache_key = render_cache_key(data_filepath, style_filepath, request)
 
-        session_id = session_id_var.get()
+    if RENDER_CACHE.fetch(cache_key, filepath):
+        alt_az = handle_observer(request.observer, {'parameters': []})[1] if request.observer else None
+        return {'file_ref': file_ref, 'alt_az': alt_az}
+    
+    soni, alt_az = sonify(data_filepath, style_filepath, request.category, request.duration, request.system, request.observer)
 
-        if not session_id:
-            raise HTTPException(status_code=400, detail="No session cookie found")
-        
-        category = FORMATTED_FILENAMES[request.category]
-        ext = '.wav'
-        filename = f'{request.data_name} {category}{ext}'
-        filepath = TMP_DIR / session_id / filename
-        soni.save(filepath, master_volume=MASTER_VOL)
+    # The existing file may be hardlinked to a cached render, so unlink it rather than writing into it
+    filepath.unlink(missing_ok=True)
+    soni.save(filepath, master_volume=MASTER_VOL)
 
-        file_ref = f'session:{filename}'
+    RENDER_CACHE.store(cache_key, filepath)
+
+    return {'file_ref': file_ref, 'alt_az': alt_az}
+
+
+def stream_sonification(request: SonificationRequest) -> dict:
+    """
+    Render a sonification block by block into its session file, which was created with begin_stream().
+    The file can be played from '/audio/{file_ref}' while this runs.
+
+    :param request: The sonification request
+
+    :return: The same as render_sonification()
+    :rtype: dict
+    """
+
+    filepath, file_ref = sonification_path(request)
+
+    try:
+        data_filepath = resolve_file(request.data_ref)
+        style_filepath = resolve_file(request.style_ref)
+
+        cache_key = render_cache_key(data_filepath, style_filepath, request)
+        cached = RENDER_CACHE.path_for(cache_key)
+
+        if cached.exists():
+            # Copy into the file being followed, rather than replacing it
+            with open(cached, 'rb') as src, open(filepath, 'r+b') as dest:
+                shutil.copyfileobj(src, dest)
+            alt_az = handle_observer(request.observer, {'parameters': []})[1] if request.observer else None
+            return {'file_ref': file_ref, 'alt_az': alt_az}
+
+        soni, alt_az = sonify(data_filepath, style_filepath, request.category, request.duration, request.system, request.observer, render=False)
+        save_streaming(soni, filepath, master_volume=MASTER_VOL)
+
+        # Streamed blocks are normalised against an estimate, so swap in the fully normalised render
+        # (and cache it), so downloads and repeat requests get the same audio as '/generate-sonification/'.
+        # Readers still following the streamed file keep reading it, as they have it open.
+        normalised = filepath.with_name(f'.{filepath.name}.{uuid.uuid4().hex}.wav')
+        try:
+            soni.save(normalised, master_volume=MASTER_VOL)
+            RENDER_CACHE.store(cache_key, normalised)
+            os.replace(normalised, filepath)
+        finally:
+            normalised.unlink(missing_ok=True)
 
         return {'file_ref': file_ref, 'alt_az': alt_az}
     
+    finally:
+        end_stream(filepath)
+
+
+def check_duration(request: SonificationRequest):
+
+    if int(request.duration) > 300:
+        raise HTTPException(status_code=400, detail="Sonification too long, maximum length = 5 minutes.")
+
+
+@router.post('/generate-sonification/')
+def generate_sonification(request: SonificationRequest):
+
+    check_duration(request)
+
+    try:
+        return render_sonification(request)
     except HTTPException:
         raise
     except Exception as e:
@@ -114,6 +267,77 @@ def generate_sonification(request: SonificationRequest):
             detail=f"{type(e).__name__}: {str(e)}"
         )
 
+
+@router.post('/render-jobs/')
+def submit_render_job(request: SonificationRequest):
+    """
+    Queue a sonification to be rendered in the background job pool.
+
+    - **request**: The same request body as '/generate-sonification/'. If 'stream' is set, the audio
+      is written in blocks and can be played from '/audio/{file_ref}' while it renders
+      (constellations and night sky only, as a light curve's audio is only finished once all of it is).
+    - Returns: The ID of the job, to poll with '/render-jobs/{job_id}', and the file ref if streaming.
+    """
+
+    check_duration(request)
+
+    # Fail fast on bad refs, rather than when the job runs
+    resolve_file(request.data_ref)
+    resolve_file(request.style_ref)
+
+    if not request.stream:
+        job_id = submit_job(render_sonification, request)
+        return {'job_id': job_id, 'status': QUEUED}
+
+    if request.category not in STREAMING_CATEGORIES:
+        raise HTTPException(status_code=400, detail=f"Streaming is not available for {request.category}")
+    
+    # Streamed audio can be requested straight away, and is served as it renders
+    filepath, file_ref = sonification_path(request)
+    begin_stream(filepath)
+
+    try:
+        # If the pool process dies, stream_sonification() can't end the stream, so end it here
+        job_id = submit_job(stream_sonification, request, on_failure=lambda: end_stream(filepath))
+    except Exception:
+        end_stream(filepath)
+        raise
+
+    return {'job_id': job_id, 'status': QUEUED, 'file_ref': file_ref}
+
+
+@router.get('/render-jobs/{job_id}')
+def get_render_job(job_id: str):
+    """
+    Get the status of a render job: 'queued', 'running', 'done' or 'error'.
+    """
+
+    job = read_job(job_id)
+
+    return {k: v for k, v in job.items() if k != 'result'}
+
+
+@router.get('/render-jobs/{job_id}/result')
+def get_render_job_result(job_id: str):
+    """
+    Get the result of a finished render job.
+
+    - Returns: The same response as '/generate-sonification/'.
+    """
+
+    job = read_job(job_id)
+
+    if job['status'] not in (DONE, ERROR):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is still {job['status']}")
+
+    # The job is finished and its result collected, so it no longer needs to take up session storage
+    delete_job(job_id)
+
+    if job['status'] == ERROR:
+        raise HTTPException(status_code=500, detail=job.get('error', 'Render failed'))
+
+    return job['result']
+
 @router.post('/generate-spectrogram/')
 def generate_spectrogram(request: DataRequest):
 
@@ -181,12 +405,21 @@ def generate_spectrogram(request: DataRequest):
     return {'image': img_base64}
 
 @router.get('/audio/{file_ref}')
-def get_audio(file_ref: str):
+async def get_audio(file_ref: str):
 
     filepath = resolve_file(file_ref)
     file_name = file_ref.split(':')[-1]
     ext = filepath.suffix.lstrip('.')
 
+    if is_rendering(filepath):
+        # Still being streamed, so send blocks as they are written
+        size = await expected_size(filepath)
+        headers = {'Content-Length': str(size)} if size else {}
+
+        return StreamingResponse(follow_file(filepath),
+                                 headers=headers,
+                                 media_type=f"audio/{ext}")
+
     return FileResponse(path=filepath, 
                         filename=file_name,
                         media_type=f"audio/{ext}")
@@ -225,27 +458,20 @@ def ensure_two_columns(ext: str, contents: bytes):
             if table_hdu is None:
                 raise HTTPException(400, "FITS file contains no table")
 
-            table = Table(table_hdu.data)
-            
-            # convert to dataframe
-            df = table.to_pandas()
-            
-            df.columns = [col.lower() for col in df.columns]
+            names = table_hdu.columns.names
+            lower_names = [name.lower() for name in names]
 
             # find time + flux columns
-            time_col = next((col for col in df.columns if "time" in col), None)
-            flux_col = next((col for col in df.columns if "flux" in col), None)
+            time_col = next((name for name, lower in zip(names, lower_names) if "time" in lower), None)
+            flux_col = next((name for name, lower in zip(names, lower_names) if "flux" in lower), None)
 
             if time_col is None or flux_col is None:
                 raise HTTPException(400, "FITS file must contain time and flux columns")
 
-            # select only those columns
-            df = df[[time_col, flux_col]]
+            # convert only those columns to a dataframe
+            df = Table(table_hdu.data)[[time_col, flux_col]].to_pandas()
             
-            df = df.rename(columns={
-                time_col: "Time (days)",
-                flux_col: "Flux (electrons per second)"
-            })
+            df.columns = ["Time (days)", "Flux (electrons per second)"]
 
 
     else:
@@ -379,6 +605,9 @@ async def uploadData(file: UploadFile, request: Request):
     # Write to new csv file
     df.to_csv(filepath, index=False)
 
+    # The data is already parsed, so summarise it now rather than reading the file again later
+    cache_data_info(Path(filepath), summarise(df.columns, df.iloc[:, 0], df.iloc[:, 1]))
+
     LOG.info(
         "Upload success | original=%s | stored=%s | size=%d | session=%s | ip=%s",
         file.filename,
@@ -403,12 +632,11 @@ def get_inputs(file_ref: str, soni_type: str, user_upload: bool = False ):
     filepath = str(resolve_file(file_ref))
     
     if filepath.endswith('.csv') and user_upload:
-        df = pd.read_csv(filepath)
+        columns = data_info(filepath)['columns']
         
         # If all column names are numeric, the data likely has no headers
-        if all(str(col).replace('.', '').replace('-', '').isnumeric() for col in df.columns):
-            df = pd.read_csv(filepath, header=None)
-            df.columns = [f"Column {i + 1}" for i in range(len(df.columns))]
+        if all(str(col).replace('.', '').replace('-', '').isnumeric() for col in columns):
+            columns = [f"Column {i + 1}" for i in range(len(columns))]
             
         inputs = [
             {
@@ -416,7 +644,7 @@ def get_inputs(file_ref: str, soni_type: str, user_upload: bool = False ):
                 'desc': '',
                 'key': col
             }
-            for col in df.columns
+            for col in columns
         ]
 
     else:
@@ -514,39 +742,102 @@ def get_styles(category: str):
 def get_sound_info():
     return all_sounds()
 
-@router.post('/preview-style-settings/{category}')
-def preview_style_settings(request: DataRequest, category: str):
-
-    style = resolve_file(request.file_ref)
-    
-    duration = 5
+def preview_data(category: str) -> tuple | Path:
+    """
+    Get the data that styles are previewed against for a category.
+    """
 
     if category == 'light_curves':
         
         n_samples = 100
         cycles = 2
 
-        x = np.linspace(0, duration, n_samples, endpoint=False)
-        freq = cycles / duration
+        x = np.linspace(0, PREVIEW_DURATION, n_samples, endpoint=False)
+        freq = cycles / PREVIEW_DURATION
 
         # Generate sine wave for light curve-like data
         y = np.sin(2 * np.pi * freq * x)
         
-        data = (x, y)
-    else:
-        data = SUGGESTED_DATA_DIR / category / 'preview.csv'
+        return (x, y)
     
+    return SUGGESTED_DATA_DIR / category / 'preview.csv'
+
+
+def preview_cache_key(style_filepath: Path, category: str) -> str:
+
+    data = preview_data(category)
+    data_id = file_digest(data) if isinstance(data, Path) else 'sine'
+
+    settings = load_settings_from_file()
+    downsampling = (settings['data_resolution'], settings['downsampling'])
+
+    return make_key(RENDER_CACHE_VERSION, 'preview', data_id, normalised_style(style_filepath), category, downsampling)
+
+
+def render_preview(style_filepath: Path, category: str, cache_key: str, dest: Path | None = None) -> Path:
+    """
+    Render the preview of a style into the preview cache.
+
+    :param dest: Also place the preview here, from the render itself (the cached copy may be evicted by another worker before it is fetched)
+    :return: Path of the cached preview
+    :rtype: Path
+    """
+
+    soni, alt_az = sonify(preview_data(category), style_filepath, category, length=PREVIEW_DURATION, system='mono')
+
+    tmp_path = PREVIEW_CACHE.cache_dir / f'.{cache_key}.{uuid.uuid4().hex}.wav'
+    soni.save(tmp_path, master_volume=MASTER_VOL)
+
+    try:
+        if dest is not None:
+            link_or_copy(tmp_path, dest)
+
+        cached = PREVIEW_CACHE.store(cache_key, tmp_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    return cached
+
+
+def prerender_previews(stop: threading.Event | None = None):
+    """
+    Render previews of all the built-in styles, so that previewing them is instant.
+
+    :param stop: Set to stop early, e.g. when the server shuts down
+    """
+
+    for category_dir in STYLE_FILES_DIR.iterdir():
+        if not category_dir.is_dir():
+            continue
+
+        for style_filepath in category_dir.glob('*.yml'):
+            if stop is not None and stop.is_set():
+                return
+            try:
+                cache_key = preview_cache_key(style_filepath, category_dir.name)
+                if not PREVIEW_CACHE.path_for(cache_key).exists():
+                    render_preview(style_filepath, category_dir.name, cache_key)
+            except Exception as e:
+                LOG.warning("Could not pre-render preview of %s: %s", style_filepath.name, e)
+
+
+@router.post('/preview-style-settings/{category}')
+def preview_style_settings(request: DataRequest, category: str):
+
+    style = resolve_file(request.file_ref)
 
     try:
-    
-        soni, alt_az = sonify(data, style, category, length=5,  system='mono')
 
         id = str(uuid.uuid4().hex)
         ext = '.wav'
         filename = f'{category}_{id}{ext}'
         session_id = session_id_var.get()
-        filepath = os.path.join(TMP_DIR, session_id, filename)
-        soni.save(filepath, master_volume=MASTER_VOL)
+        filepath = TMP_DIR / session_id / filename
+
+        cache_key = preview_cache_key(style, category)
+
+        if not PREVIEW_CACHE.fetch(cache_key, filepath):
+            render_preview(style, category, cache_key, dest=filepath)
 
         file_ref = f'session:{filename}'
 
@@ -635,6 +926,9 @@ async def download_online_asset(target_name: str):
         with zipfile.ZipFile(write_path, 'r') as zip_ref:
             zip_ref.extractall(SAMPLES_DIR)
 
+        # Pick up the new sound straight away
+        sound_registry.refresh()
+
     # Delete the zip file after extraction
     write_path.unlink(missing_ok=True)
 
@@ -0,0 +1,310 @@
+from pathlib import Path
+from paths import CACHE_DIR
+from cache import FileCache, MemoryCache, file_digest, make_key
+from astropy.io import fits
+import lightkurve as lk
+import numpy as np
+import pandas as pd
+import json, uuid
+
+# Decoded data files, keyed by (path, mtime, size)
+DATASET_CACHE_MAX_MB = 512
+DATASET_CACHE = MemoryCache(max_bytes=DATASET_CACHE_MAX_MB * 1024 * 1024)
+
+# Decoded FITS light curves saved as .npz, so other workers (and restarts) skip astropy entirely
+LIGHT_CURVE_CACHE_MAX_MB = 1024
+LIGHT_CURVE_CACHE_VERSION = 1
+
+LIGHT_CURVE_CACHE = FileCache(
+    cache_dir=CACHE_DIR / 'light_curves',
+    max_bytes=LIGHT_CURVE_CACHE_MAX_MB * 1024 * 1024,
+    suffix='.npz'
+)
+
+# Summaries of data files (see data_info()), keyed by (path, mtime, size)
+DATA_INFO_CACHE = MemoryCache(max_bytes=4 * 1024 * 1024)
+DATA_INFO_NBYTES = 1024
+
+# Light curve flux columns, in the order lightkurve would choose them
+FITS_FLUX_COLUMNS = ('PDCSAP_FLUX', 'SAP_FLUX', 'FLUX')
+
+# Quality flags (and the column they're in) that lightkurve masks by default, per telescope
+FITS_QUALITY_COLUMNS = {
+    'TESS': (lk.utils.TessQualityFlags, 'QUALITY'),
+    'KEPLER': (lk.utils.KeplerQualityFlags, 'SAP_QUALITY')
+}
+
+
+class Dataset:
+    """Columns of a data file as NumPy arrays, parsed once and shared by each step of a sonification."""
+
+    def __init__(self, columns: dict[str, np.ndarray], format: str, meta: dict | None = None):
+        """
+        Initialize dataset.
+
+        Args:
+            columns: Column name to values, all of the same length
+            format: Where the data came from, 'csv', 'fits' or 'tuple'
+            meta: Header metadata, e.g. the FITS header of a light curve
+        """
+        self.columns = columns
+        self.format = format
+        self.meta = meta or {}
+
+    @property
+    def names(self) -> list[str]:
+        return list(self.columns)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(values.nbytes for values in self.columns.values())
+
+    def freeze(self):
+        """Make the columns read-only, so a cached Dataset can't be changed by the code using it."""
+        for values in self.columns.values():
+            values.flags.writeable = False
+
+    def dropna(self, names: list[str] | None = None) -> 'Dataset':
+        """
+        Remove rows with missing values.
+
+        Args:
+            names: Columns to check, all columns by default
+
+        Returns:
+            New Dataset without the incomplete rows
+        """
+        names = self.names if names is None else names
+
+        keep = np.ones(len(self), dtype=bool)
+        for name in names:
+            keep &= ~pd.isna(self.columns[name])
+
+        if keep.all():
+            return self
+
+        return Dataset({name: values[keep] for name, values in self.columns.items()}, self.format, self.meta)
+
+
+def column_values(column) -> np.ndarray:
+    """Get the plain values of a light curve column, with masked values left as they are stored (NaN)."""
+    values = getattr(column, 'unmasked', column)
+    values = getattr(values, 'value', values)
+    return np.asarray(values)
+
+
+def load_dataset(data: Dataset | Path | str | tuple) -> Dataset:
+    """
+    Parse a data file (or (x, y) tuple) into a Dataset, reusing the decoded file where possible.
+
+    Args:
+        data: Path of a .csv or .fits file, an (x, y) tuple of time and flux, or an already loaded Dataset
+
+    Returns:
+        The loaded Dataset, whose columns are read-only if it came from a file
+    """
+    if isinstance(data, Dataset):
+        return data
+
+    if isinstance(data, tuple):
+        return Dataset({'time': np.asarray(data[0]), 'flux': np.asarray(data[1])}, 'tuple')
+
+    filepath = Path(data)
+
+    if filepath.suffix not in ('.csv', '.fits'):
+        raise ValueError('Data file must be a .csv or .fits file.')
+
+    cache_key = file_key(filepath)
+
+    dataset = DATASET_CACHE.get(cache_key)
+
+    if dataset is None:
+        dataset = read_csv(filepath) if filepath.suffix == '.csv' else read_fits(filepath)
+        dataset.freeze()
+        DATASET_CACHE.put(cache_key, dataset, dataset.nbytes)
+
+    return dataset
+
+
+def file_key(filepath: Path) -> tuple:
+    """Cache key for a data file, which changes whenever the file is rewritten."""
+    stat = filepath.stat()
+    return (str(filepath.resolve()), stat.st_mtime_ns, stat.st_size)
+
+
+def data_info(data_file: Path | str) -> dict:
+    """
+    Summarise a data file without decoding all of it: FITS files are read column by column
+    from a memory map, and only the first two columns of a CSV are parsed.
+
+    Args:
+        data_file: Path of a .csv or .fits file
+
+    Returns:
+        Dict of 'columns', 'range' (of the time column), 'points', 'cadence' and 'nan_fraction' (of the flux column)
+    """
+    filepath = Path(data_file)
+
+    if filepath.suffix not in ('.csv', '.fits'):
+        raise ValueError('Data file must be a .csv or .fits file.')
+
+    cache_key = file_key(filepath)
+    info = DATA_INFO_CACHE.get(cache_key)
+
+    if info is not None:
+        return info
+
+    if filepath.suffix == '.csv':
+        info = csv_info(filepath, DATASET_CACHE.get(cache_key))
+    else:
+        info = fits_info(filepath)
+
+    cache_data_info(filepath, info)
+
+    return info
+
+
+def cache_data_info(filepath: Path, info: dict):
+    """Cache the summary of a data file, e.g. from data that was just written to it."""
+    DATA_INFO_CACHE.put(file_key(filepath), info, DATA_INFO_NBYTES)
+
+
+def summarise(columns: list[str], time, flux=None) -> dict:
+    """
+    Summarise a series for data_info().
+
+    Args:
+        columns: Column names of the data file
+        time: Time values
+        flux: Data values, if the file has any
+    """
+    # Values that aren't numbers count as missing
+    time = pd.to_numeric(np.asarray(time), errors='coerce').astype(float)
+    finite_time = time[np.isfinite(time)]
+
+    if finite_time.size:
+        value_range = [float(finite_time.min()), float(finite_time.max())]
+    else:
+        value_range = None
+
+    cadence = float(np.median(np.diff(finite_time))) if finite_time.size > 1 else None
+
+    if flux is not None and time.size:
+        nan_fraction = float(np.count_nonzero(pd.isna(pd.to_numeric(np.asarray(flux), errors='coerce'))) / time.size)
+    else:
+        nan_fraction = None
+
+    return {
+        'columns': [str(col) for col in columns],
+        'range': value_range,
+        'points': int(time.size),
+        'cadence': cadence,
+        'nan_fraction': nan_fraction
+    }
+
+
+def csv_info(filepath: Path, dataset: Dataset | None = None) -> dict:
+    """
+    Summarise a CSV from its first two columns, using the decoded file if it is already loaded.
+    """
+    if dataset is None:
+        columns = pd.read_csv(filepath, nrows=0).columns
+        df = pd.read_csv(filepath, usecols=range(min(len(columns), 2)))
+        values = [df[col].to_numpy() for col in df.columns]
+    else:
+        columns = dataset.names
+        values = [dataset[col] for col in columns[:2]]
+
+    return summarise(columns, values[0], values[1] if len(values) > 1 else None)
+
+
+def fits_info(filepath: Path) -> dict:
+    """
+    Summarise a FITS light curve from its time, flux and quality columns, leaving out
+    the cadences lightkurve.read() would (NaN times, and bad quality flags for Kepler and TESS).
+    """
+    with fits.open(filepath, memmap=True) as hdul:
+        table_hdu = next((hdu for hdu in hdul if isinstance(hdu, fits.BinTableHDU)), None)
+
+        if table_hdu is None:
+            raise ValueError(f'{filepath.name} contains no light curve table.')
+
+        names = [name.upper() for name in table_hdu.columns.names]
+        data = table_hdu.data
+
+        # Only these columns are read from disk
+        time = np.array(data.field(names.index('TIME')), dtype=float)
+        flux_name = next((name for name in FITS_FLUX_COLUMNS if name in names), None)
+        flux = np.array(data.field(names.index(flux_name)), dtype=float) if flux_name else None
+
+        keep = ~np.isnan(time)
+
+        quality_flags, quality_name = FITS_QUALITY_COLUMNS.get(str(hdul[0].header.get('TELESCOP', '')).upper(), (None, None))
+
+        if quality_name in names:
+            keep &= quality_flags.create_quality_mask(np.array(data.field(names.index(quality_name))), 'default')
+
+    return summarise([name.lower() for name in names], time[keep], flux[keep] if flux is not None else None)
+
+
+def read_csv(filepath: Path) -> Dataset:
+
+    df = pd.read_csv(filepath)
+    columns = {col: df[col].to_numpy() for col in df.columns}
+
+    return Dataset(columns, 'csv', {'filepath': str(filepath)})
+
+
+def read_fits(filepath: Path) -> Dataset:
+    """
+    Read a FITS light curve, from its .npz copy in the light curve cache if there is one.
+    """
+    cache_key = make_key(LIGHT_CURVE_CACHE_VERSION, file_digest(filepath))
+    cached = LIGHT_CURVE_CACHE.lookup(cache_key)
+
+    if cached:
+        try:
+            return load_npz(cached, filepath)
+        except (OSError, ValueError, KeyError):
+            # Evicted or corrupt, so read the FITS file again
+            pass
+
+    lc = lk.read(filepath)
+    columns = {name: column_values(lc[name]) for name in lc.colnames}
+    meta = {**lc.meta, 'time_format': lc.time.format, 'time_scale': lc.time.scale}
+    units = {name: str(lc[name].unit) for name in lc.colnames if getattr(lc[name], 'unit', None) is not None}
+
+    dataset = Dataset(columns, 'fits', {'filepath': str(filepath), 'units': units, **meta})
+
+    save_npz(dataset, cache_key)
+
+    return dataset
+
+
+def save_npz(dataset: Dataset, cache_key: str):
+
+    # Write to a hidden temporary file first, so other workers never load a partial file
+    tmp_path = LIGHT_CURVE_CACHE.cache_dir / f'.{cache_key}.{uuid.uuid4().hex}.npz'
+
+    # Header values aren't all JSON types (e.g. astropy's Undefined), so store those as strings
+    meta = json.dumps({k: v for k, v in dataset.meta.items() if k != 'filepath'}, default=str)
+
+    np.savez(tmp_path, __meta__=np.array(meta), **{f'col:{name}': values for name, values in dataset.columns.items()})
+
+    LIGHT_CURVE_CACHE.store(cache_key, tmp_path)
+    tmp_path.unlink(missing_ok=True)
+
+
+def load_npz(npz_path: Path, filepath: Path) -> Dataset:
+
+    with np.load(npz_path, allow_pickle=False) as npz:
+        meta = json.loads(str(npz['__meta__']))
+        columns = {name[len('col:'):]: npz[name] for name in npz.files if name.startswith('col:')}
+
+    return Dataset(columns, 'fits', {'filepath': str(filepath), **meta})
@@ -0,0 +1,125 @@
+from fastapi import HTTPException
+from pathlib import Path
+from cache import FileCache
+from config import DOWNLOAD_TIMEOUT_SECONDS, DOWNLOAD_MAX_MB
+import asyncio, aiofiles, httpx, uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Client shared by all downloads, so connections to the same host are reused
+_client: httpx.AsyncClient | None = None
+
+# Downloads in progress, keyed by cache key, so concurrent requests for a file share one download
+_in_flight: dict[str, asyncio.Task] = {}
+
+# Number of requests waiting on each download in progress
+_waiters: dict[str, int] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the pooled HTTP client, creating it on first use."""
+    global _client
+
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(DOWNLOAD_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            follow_redirects=True
+        )
+
+    return _client
+
+
+async def close_client():
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def download_to_cache(cache: FileCache, key: str, url: str, speculative: bool = False) -> Path:
+    """
+    Download a file into a cache, unless the same file is already being downloaded, in which case wait for that.
+
+    Args:
+        cache: Cache to store the file in
+        key: Cache key of the file
+        url: URL to download from
+        speculative: Whether the file might not be needed (e.g. a prefetch), so the download stops
+            if this request is cancelled while nothing else is waiting on it
+
+    Returns:
+        Path of the cached file
+    """
+    task = _in_flight.get(key)
+
+    if task is None:
+        task = asyncio.create_task(download(cache, key, url))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    _waiters[key] = _waiters.get(key, 0) + 1
+
+    try:
+        # Shield the download, so one request giving up doesn't cancel it for the others waiting on it
+        return await asyncio.shield(task)
+
+    except asyncio.CancelledError:
+        if speculative and _waiters[key] == 1:
+            task.cancel()
+        raise
+
+    finally:
+        _waiters[key] -= 1
+        if _waiters[key] == 0:
+            del _waiters[key]
+
+
+async def download(cache: FileCache, key: str, url: str) -> Path:
+    """
+    Stream a file to a temporary file, then add it to the cache.
+
+    Raises:
+        HTTPException: If the download fails, times out or is bigger than DOWNLOAD_MAX_MB
+    """
+    max_bytes = DOWNLOAD_MAX_MB * 1024 * 1024
+    tmp_path = cache.cache_dir / f'.{key}.{uuid.uuid4().hex}.tmp'
+
+    async def stream():
+        async with get_client().stream('GET', url) as response:
+            response.raise_for_status()
+
+            content_length = int(response.headers.get('content-length', 0))
+            if content_length > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File is larger than the {DOWNLOAD_MAX_MB} MB download limit")
+
+            size = 0
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+
+                    # Servers don't always send a length, so check as it arrives too
+                    if size > max_bytes:
+                        raise HTTPException(status_code=413, detail=f"File is larger than the {DOWNLOAD_MAX_MB} MB download limit")
+
+                    await f.write(chunk)
+
+    try:
+        await asyncio.wait_for(stream(), timeout=DOWNLOAD_TIMEOUT_SECONDS)
+
+        # Linked into the cache by an atomic rename, so nothing ever sees a partial download
+        return cache.store(key, tmp_path)
+
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        logger.warning(f"Download timed out: {url}")
+        raise HTTPException(status_code=504, detail="Download timed out")
+    except httpx.HTTPStatusError as e:
+        logger.warning(f"Download failed with status {e.response.status_code}: {url}")
+        raise HTTPException(status_code=502, detail=f"Download failed with status {e.response.status_code}")
+    except httpx.HTTPError as e:
+        logger.warning(f"Download failed: {url} ({e})")
+        raise HTTPException(status_code=502, detail="Download failed")
+    finally:
+        tmp_path.unlink(missing_ok=True)
@@ -0,0 +1,245 @@
+import numpy as np
+
+# Ways of reducing a light curve to the number of notes that can be played
+DOWNSAMPLING_MODES = ('mean', 'minmax', 'lttb')
+
+
+def bin_starts(n_points: int, n_bins: int) -> np.ndarray:
+    """
+    Get the start index of each bin when splitting n_points into n_bins, sized as np.array_split() would.
+
+    Returns:
+        Array of n_bins start indices
+    """
+    size, extra = divmod(n_points, n_bins)
+
+    # The first 'extra' bins hold one more point than the rest
+    sizes = np.full(n_bins, size)
+    sizes[:extra] += 1
+
+    return np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+
+def bin_mean(x: np.ndarray, y: np.ndarray, n_out: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Average y in n_out bins, spacing the bins evenly between the first and last x.
+    """
+    starts = bin_starts(y.size, n_out)
+    counts = np.diff(np.append(starts, y.size))
+
+    new_y = np.add.reduceat(y, starts) / counts
+    new_x = np.linspace(x[0], x[-1], n_out)
+
+    return new_x, new_y
+
+
+def bin_minmax(x: np.ndarray, y: np.ndarray, n_out: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Keep the minimum and maximum of each of n_out / 2 bins, in the order they occur,
+    so peaks and dips (e.g. transits and eclipses) survive downsampling.
+    Every bin needs a finite minimum and maximum, so y must not contain NaNs.
+    With room for fewer than two points, the mean is kept instead.
+    """
+    if n_out < 2:
+        return bin_mean(x, y, n_out)
+
+    n_bins = n_out // 2
+    starts = bin_starts(y.size, n_bins)
+    bin_ids = np.repeat(np.arange(n_bins), np.diff(np.append(starts, y.size)))
+
+    imin = first_in_bin(y == np.minimum.reduceat(y, starts)[bin_ids], bin_ids)
+    imax = first_in_bin(y == np.maximum.reduceat(y, starts)[bin_ids], bin_ids)
+
+    # Interleave each bin's two points in time order
+    idx = np.column_stack((np.minimum(imin, imax), np.maximum(imin, imax))).ravel()
+
+    return x[idx], y[idx]
+
+
+def first_in_bin(mask: np.ndarray, bin_ids: np.ndarray) -> np.ndarray:
+    """Get the index of the first True value of mask in each bin (every bin must have one)."""
+    idx = np.flatnonzero(mask)
+    ids = bin_ids[idx]
+
+    # Indices are in order, so a bin's first is wherever the bin ID changes
+    first = np.ones(ids.size, dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+
+    return idx[first]
+
+
+def decimate_for_plot(x, y, n_columns: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce a series to the first, last, minimum and maximum points of each pixel column it would be plotted across,
+    which draws the same line as the full series at that width.
+
+    Args:
+        x: Time values
+        y: Data values, where NaNs break the plotted line
+        n_columns: Number of pixel columns the series is plotted across
+
+    Returns:
+        Decimated (x, y), with NaNs wherever the full series had a break in the line
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    if n_columns <= 0:
+        return x[:0], y[:0]
+
+    finite = np.isfinite(x) & np.isfinite(y)
+    fx = x[finite]
+    fy = y[finite]
+
+    # Lines are drawn in data order, so unsorted data can't be split into columns
+    if fy.size <= 4 * n_columns or np.any(np.diff(fx) < 0):
+        return x, y
+
+    # Pixel column of each point
+    span = fx[-1] - fx[0]
+    columns = ((fx - fx[0]) / span * n_columns).astype(int) if span else np.zeros(fx.size, dtype=int)
+    columns = np.minimum(columns, n_columns - 1)
+
+    starts = np.flatnonzero(np.diff(columns, prepend=-1))
+    bin_ids = np.repeat(np.arange(starts.size), np.diff(np.append(starts, fy.size)))
+
+    imin = first_in_bin(fy == np.minimum.reduceat(fy, starts)[bin_ids], bin_ids)
+    imax = first_in_bin(fy == np.maximum.reduceat(fy, starts)[bin_ids], bin_ids)
+    ilast = np.append(starts[1:] - 1, fy.size - 1)
+
+    keep = np.flatnonzero(finite)[np.unique(np.concatenate((starts, imin, imax, ilast)))]
+
+    # Put back a break wherever there were NaNs between two kept points
+    nans_before = np.cumsum(~finite)
+    breaks = np.flatnonzero(np.diff(nans_before[keep])) + 1
+
+    return np.insert(x[keep], breaks, np.nan), np.insert(y[keep], breaks, np.nan)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Largest-Triangle-Three-Buckets: keep the first and last points, and from each bucket in between
+    the point forming the largest triangle with the previously kept point and the next bucket's average.
+    """
+    if n_out < 3:
+        return x[[0, -1]], y[[0, -1]]
+
+    # Buckets cover everything but the first and last points
+    starts = bin_starts(y.size - 2, n_out - 2) + 1
+    ends = np.append(starts[1:], y.size - 1)
+
+    # Averages of each bucket, with the last point standing in for the bucket after the last
+    counts = ends - starts
+    avg_x = np.append(np.add.reduceat(x[1:-1], starts - 1) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[1:-1], starts - 1) / counts, y[-1])
+
+    idx = np.empty(n_out, dtype=int)
+    idx[0] = 0
+    idx[-1] = y.size - 1
+
+    a = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        bx = x[start:end]
+        by = y[start:end]
+
+        # Twice the triangle area, which is enough to compare
+        area = np.abs((x[a] - avg_x[i+1]) * (by - y[a]) - (x[a] - bx) * (avg_y[i+1] - y[a]))
+
+        a = start + int(np.argmax(area))
+        idx[i+1] = a
+
+    return x[idx], y[idx]
+
+
+def resample(x, columns: dict[str, np.ndarray], n_out: int) -> dict[str, np.ndarray]:
+    """
+    Linearly interpolate columns onto n_out evenly spaced x values between the smallest and largest x.
+
+    Args:
+        x: Time values, in any order
+        columns: Values at each x, by name
+        n_out: Number of points to resample to
+
+    Returns:
+        Resampled columns, by name
+    """
+    x = np.asarray(x, dtype=float)
+
+    # np.interp needs increasing x
+    order = np.argsort(x, kind='stable')
+    x = x[order]
+
+    grid = np.linspace(x[0], x[-1], n_out)
+
+    return {name: np.interp(grid, x, np.asarray(values, dtype=float)[order]) for name, values in columns.items()}
+
+
+def absolute_lims(values, lims: tuple, func=None) -> tuple:
+    """
+    Convert mapping limits given as percentiles (e.g. ('5%', '95%')) to the values strauss would use for them,
+    so the limits of data that is then resampled stay those of the full data.
+
+    Args:
+        values: Input data of the mapping
+        lims: Lower and upper limits, as numbers or percentile strings
+        func: Mapping function applied to the data before its limits, if any
+
+    Returns:
+        Tuple of absolute limits
+    """
+    values = func(values) if func else values
+    absolute = []
+
+    for lim in lims:
+        if isinstance(lim, str):
+            pc = float(lim.strip('%'))
+            buff, sub = 1, 0
+
+            # Over 100% extends past the maximum, in proportion to the range from the lower limit
+            if pc > 100:
+                buff = pc / 100
+                pc = 100
+                sub = absolute[0]
+
+            absolute.append(float(sub + (np.percentile(values, pc) - sub) * buff))
+        else:
+            absolute.append(lim)
+
+    return tuple(absolute)
+
+
+def downsample(x, y, n_out: int, mode: str = 'mean') -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce a series to around n_out points.
+
+    Args:
+        x: Time values, in ascending order
+        y: Data values
+        n_out: Number of points to reduce to
+        mode: 'mean' to average bins, 'minmax' to keep each bin's extremes or 'lttb' to keep the visually significant points
+
+    Returns:
+        Downsampled (x, y), or the original series if it already has n_out points or fewer (and nothing if n_out is 0).
+        Points where x or y is NaN are dropped first.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+
+    if n_out <= 0:
+        return x[:0], y[:0]
+
+    if y.size <= n_out:
+        return x, y
+
+    if mode == 'mean':
+        return bin_mean(x, y, n_out)
+    elif mode == 'minmax':
+        return bin_minmax(x, y, n_out)
+    elif mode == 'lttb':
+        return lttb(x, y, n_out)
+
+    raise ValueError(f'Downsampling mode "{mode}" not recognised, must be one of {DOWNSAMPLING_MODES}.')
@@ -7,6 +7,11 @@ from musical_scales import scale as parse_scale
 from style_schemas import BaseStyle, ParameterMapping
 from settings import load_settings_from_file
 from generator_mods import GENERATOR_MODS
+from sample_bank import BankSampler, load_bank
+from sounds import sound_registry
+from dataset import Dataset, load_dataset
+from cache import MemoryCache
+from downsampling import downsample, resample, absolute_lims
 from pychord import Chord
 from pychord.utils import transpose_note
 from paths import *
@@ -14,9 +19,7 @@ from pydantic import ValidationError
 from night_sky import handle_observer
 from copy import deepcopy
 
-import lightkurve as lk
 import numpy as np
-import pandas as pd
 import random, os, yaml
 import matplotlib.pyplot as plt
 from pathlib import Path
@@ -24,6 +27,8 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Values per second of audio that evolving parameters are resampled to, far more than can be heard changing
+CONTROL_RATE = 300
 
 
 
@@ -39,63 +44,57 @@ def read_YAML_file(filepath):
     
     return YAML_dict
 
-def sonify(data: Path | str | tuple, style_file: Path | str | dict, sonify_type: str, length=15, system='mono', observer=None):
+def sonify(data: Path | str | tuple, style_file: Path | str | dict, sonify_type: str, length=15, system='mono', observer=None, render=True):
+
+      alt_az = None
 
       # Load and validate user style
-      style_dict = read_YAML_file(style_file) if isinstance(style_file, (Path, str)) else style_file
+      if isinstance(style_file, (Path, str)) and not observer:
+            compiled = load_compiled_style(style_file)
+      else:
+            style_dict = read_YAML_file(style_file) if isinstance(style_file, (Path, str)) else style_file
+
+            # The observer's position changes the style, so these can't be reused
+            if observer:
+                  style_dict, alt_az = handle_observer(observer, style_dict)
+
+            compiled = CompiledStyle(BaseStyle.model_validate(style_dict))
+
+      # Parse the data once, for both validation and setting up the Sources
+      dataset = load_dataset(data)
 
       # validate input parameters against data headers
-      validate_input_params(style_dict, data)
-      
-      if observer:
-            style_dict, alt_az = handle_observer(observer, style_dict)
-      else:
-            alt_az = None
-            
-      # Validate entire style file
-      validated_style = BaseStyle.model_validate(style_dict)
+      validate_input_params(compiled.style, dataset)
         
       # Set up Sonification elements
-      score, sources, generator = setup_strauss(data, validated_style, sonify_type, length)
+      score, sources, generator = setup_strauss(dataset, compiled, sonify_type, length)
 
       # Render sonification
       sonification = Sonification(score, sources, generator, system)
 
-      sonification.render()
+      # Streaming renders the sonification block by block itself
+      if render:
+            sonification.render()
 
       return sonification, alt_az
 
-def validate_input_params(style: dict, data: Path | str | tuple):
+def validate_input_params(style: BaseStyle, dataset: Dataset):
 
-      if isinstance(data, tuple):
+      if dataset.format == 'tuple':
             pass
       else:
-            data_filepath = str(data)
-
-            if data_filepath.endswith('.csv'):
-
-                  df = pd.read_csv(data_filepath)
-                  
-            elif data_filepath.endswith('.fits'):
-
-                  lc = lk.read(data_filepath)
-                  df = lc.to_pandas()
-                  df['time'] = None
-            else:
-                  raise ValueError('Data file must be a .csv or .fits file.')
-            
-            col_headers = df.columns.tolist()
+            col_headers = dataset.names
             col_headers_lower = [col.lower() for col in col_headers]
 
-            mappings = style['parameters']
+            mappings = style.parameters
 
             for mapping in mappings:
                   
-                  if isinstance(mapping['input'], float):
+                  if isinstance(mapping.input, float):
                         continue
                 
-                  input_param = mapping['input'].lower()
-                  in_min, in_max = mapping.get('input_range', ('0%','100%'))
+                  input_param = mapping.input.lower()
+                  in_min, in_max = mapping.input_range
 
                   # if input_param not in col_headers_lower:
                   #       raise ValueError(f'Input parameter "{input_param}" not found in data columns: {col_headers}')
@@ -105,9 +104,9 @@ def validate_input_params(style: dict, data: Path | str | tuple):
                         continue
                   
                   col_index = col_headers_lower.index(input_param)
-                  col_data = df.iloc[:, col_index]
+                  col_data = dataset[col_headers[col_index]]
 
-                  mapping['input'] = col_headers[col_index]  # Update style with original case-sensitive name from data
+                  mapping.input = col_headers[col_index]  # Update style with original case-sensitive name from data
 
                   # How do we check range for absolute values? I.E 20 to 5000 instead of 0 to 1
 
@@ -115,36 +114,24 @@ def validate_input_params(style: dict, data: Path | str | tuple):
                   #       raise ValidationError(f'Input parameter "{input_param}" has data outside specified input_range [{in_min}, {in_max}]. Actual data range: [{col_data.min()}, {col_data.max()}]')
             
 
-def ensure_array(data):
-      return data if isinstance(data, np.ndarray) else np.array(data)
-
-
 def find_sound(sound_name):
 
-    # Search for any file starting with 'sound_name'
-    synth_matches = list(SYNTHS_DIR.glob(f"{sound_name}.*"))
-    samples_matches = list(SAMPLES_DIR.glob(f"{sound_name}*"))
+    sound = sound_registry.get(sound_name)
 
-    if synth_matches and samples_matches:
+    if sound_registry.is_duplicate(sound_name):
           raise ValueError(f'The name "{sound_name}" is present in both /synths and /samples directories.')
-    elif synth_matches:
-        return "synths", synth_matches[0]
-    elif samples_matches:
-        return "samples", samples_matches[0]
+    elif sound:
+        return sound.folder, sound.path
     else:
         raise ValueError(f'"{sound_name}" not found in the sound_assets directory.')
 
 
-def get_filepath(directory):
-      name = os.listdir(directory)[0]
-      return os.path.join(directory, name)
-
+def setup_strauss(dataset: Dataset, compiled: 'CompiledStyle', sonify_type, length):
 
+      style = compiled.style
 
-def setup_strauss(data: Path | str | tuple, style: BaseStyle, sonify_type, length):
-
-      # Read and find sound to create Generator
-      folder, path = find_sound(style.sound)
+      # Create Generator from the sound found when compiling the style
+      folder, path = compiled.folder, compiled.path
 
       if folder == 'synths':
             generator = Synthesizer()
@@ -153,9 +140,8 @@ def setup_strauss(data: Path | str | tuple, style: BaseStyle, sonify_type, lengt
 
             # NOTE To do: Modify preset for ADSR if using scale
       else:
-            path = str(path)
-            inner_file = get_filepath(path)
-            generator = Sampler(inner_file, sf_preset=1) if inner_file.endswith('.sf2') else Sampler(path)
+            # Samples are decoded once into a shared, memory-mapped bank
+            generator = BankSampler(load_bank(path))
 
             if style.preset:
                   generator.load_preset(style.preset)
@@ -176,24 +162,14 @@ def setup_strauss(data: Path | str | tuple, style: BaseStyle, sonify_type, lengt
       
       # Set up the data and Sources
       if sonify_type == 'light_curves':
-            sources = light_curve_sources(data, style, length)
+            sources = light_curve_sources(dataset, style, length)
       elif sonify_type == 'constellations' or sonify_type == 'night_sky':
-            sources = constellation_sources(data, style, length)
+            sources = constellation_sources(dataset, style, length)
       else:
             raise ValueError(f'Sonification type "{sonify_type}" not recognised.')
       
-      # Handle chord or scale
-      is_chord = False
-      
-      if style.harmony:
-
-            if isinstance(style.harmony, str):
-                  notes, is_chord = parse_harmony(style.harmony, folder, path)
-            else:
-                  notes = [style.harmony]
-                  
-      else:
-            notes = [['A3']] # Change this?
+      # Chord or scale notes were parsed when compiling the style
+      notes, is_chord = compiled.notes, compiled.is_chord
             
       pitch_bin_mode = 'uniform' if 'pitch' in outputs and not is_chord else 'adaptive'
       
@@ -201,6 +177,53 @@ def setup_strauss(data: Path | str | tuple, style: BaseStyle, sonify_type, lengt
 
       return score, sources, generator
 
+class CompiledStyle:
+      """A validated style with its sound found and harmony parsed, ready to set up a sonification."""
+
+      def __init__(self, style: BaseStyle):
+
+            self.style = style
+            self.folder, self.path = find_sound(style.sound)
+
+            # Handle chord or scale
+            self.is_chord = False
+
+            if style.harmony:
+
+                  if isinstance(style.harmony, str):
+                        self.notes, self.is_chord = parse_harmony(style.harmony, self.folder, self.path)
+                  else:
+                        self.notes = [style.harmony]
+                        
+            else:
+                  self.notes = [['A3']] # Change this?
+
+
+# Compiled style files, keyed by (path, mtime, size) so edited files are compiled again,
+# and by the sound registry's generation, as compiling a style finds its sound
+COMPILED_STYLES = MemoryCache(max_bytes=16 * 1024 * 1024)
+COMPILED_STYLE_NBYTES = 64 * 1024
+
+def load_compiled_style(style_file: Path | str) -> CompiledStyle:
+      """
+      Get the compiled version of a style file, compiling it on first use.
+
+      Returns a copy, as setting up Sources modifies the style's parameter mappings.
+      """
+
+      filepath = Path(style_file)
+      stat = filepath.stat()
+      key = (str(filepath.resolve()), stat.st_mtime_ns, stat.st_size, sound_registry.generation())
+
+      compiled = COMPILED_STYLES.get(key)
+
+      if compiled is None:
+            compiled = CompiledStyle(BaseStyle.model_validate(read_YAML_file(filepath)))
+            COMPILED_STYLES.put(key, compiled, COMPILED_STYLE_NBYTES)
+
+      return deepcopy(compiled)
+
+
 def parse_harmony(harmony: str, sound_folder, sound_path):
 
       if ' ' in harmony:
@@ -227,13 +250,13 @@ def parse_harmony(harmony: str, sound_folder, sound_path):
 
 def constrain_notes(desired_notes, sound_path):
     
-    sample_folder = Path(sound_path)
-    available_notes = [p.stem for p in sample_folder.iterdir() if p.is_file()]
-    
-    def extract_note(stem):
-        return stem.split('_')[-1]
-    
-    available_note_set = {extract_note(stem) for stem in available_notes}
+    sound_name = Path(sound_path).stem
+    sound = sound_registry.get(sound_name)
+
+    if sound is None:
+        raise ValueError(f'"{sound_name}" not found in the sound_assets directory.')
+
+    available_note_set = sound.notes
     
     constrained = []
     
@@ -271,22 +294,21 @@ def parse_percentile(val):
         return float(val.strip('%'))
     return float(val)
 
-def constellation_sources(data: Path | str , style: BaseStyle, length):
-
-      data_filepath = str(data)
+def constellation_sources(dataset: Dataset, style: BaseStyle, length):
 
-      if data_filepath.endswith('.csv'):
-
-            df = pd.read_csv(data_filepath)
-      else:
+      if dataset.format != 'csv':
             raise ValueError('Data file must be a .csv file.')
       
       # Remove rows with NaN values in any of the columns used
       input_params = [mapping.input for mapping in style.parameters if isinstance(mapping.input, str)]
-      df = df.dropna(subset=input_params)
+      dataset = dataset.dropna(input_params)
+
+      # Copy the column mapping, so rescaled columns don't change the Dataset
+      columns = dict(dataset.columns)
+      n_rows = len(dataset)
 
       data_dict = {
-            'pitch': [0]*len(df)
+            'pitch': [0]*n_rows
       }
       m_lims = {}
       p_lims = {}
@@ -309,10 +331,10 @@ def constellation_sources(data: Path | str , style: BaseStyle, length):
 
             if output == 'azimuth' and isinstance(input, str):
                   # Rescale input values if using azimuth
-                  df[input] = rescale_col(df, input, (0, 1))
+                  columns[input] = rescale_col(columns[input], (0, 1))
 
                   # Add constant polar of 0.5
-                  data_dict['polar'] = np.full(len(df), 0.5)
+                  data_dict['polar'] = np.full(n_rows, 0.5)
 
             # Invert data for e.g. magnitude (smaller magnitude is brighter)
             if mapping.function == 'invert':
@@ -321,10 +343,10 @@ def constellation_sources(data: Path | str , style: BaseStyle, length):
             # Map data
             if isinstance(input, float):
                   # Is a constant spatial param, e.g. azimuth or polar
-                  data_dict[output] = np.full(len(df), input)
+                  data_dict[output] = np.full(n_rows, input)
             else:
                   # Every other type of param
-                  data_dict[output] = df[input].to_numpy(dtype=float)
+                  data_dict[output] = columns[input].astype(float)
                   m_lims[output] = mapping.input_range
 
             if mapping.output_range:
@@ -348,19 +370,20 @@ def constellation_sources(data: Path | str , style: BaseStyle, length):
       
             
 
-def rescale_col(df, col, target_range=(0.0, 1.0)):
+def rescale_col(values: np.ndarray, target_range=(0.0, 1.0)):
     t_min, t_max = target_range
+    values = values.astype(float)
 
     # If the column has one unique value, fallback to center of the target range
-    if df[col].nunique() == 1:
+    if np.unique(values).size == 1:
         center = (t_min + t_max) / 2
-        return pd.Series(center, index=df.index)
+        return np.full(values.shape, center)
 
-    min_val = df[col].min()
-    max_val = df[col].max()
+    min_val = values.min()
+    max_val = values.max()
 
     # Normalize to 0–1, then stretch to target range
-    normalized = (df[col] - min_val) / (max_val - min_val)
+    normalized = (values - min_val) / (max_val - min_val)
 
     return t_min + normalized * (t_max - t_min)
 
@@ -385,10 +408,13 @@ def convert_percent_to_values(param_lims: tuple):
     return (low_val, high_val)
 
 
-def scale_events(labelled_data: dict, params: list[ParameterMapping], length):
+def scale_events(labelled_data: dict, params: list[ParameterMapping], length, downsampling=None):
       
       user_settings = load_settings_from_file()
       resolution = user_settings['data_resolution']
+
+      # The style's downsampling mode takes priority over the user's setting
+      mode = downsampling or user_settings['downsampling']
       
       time_input = next((p.input for p in params if p.output == 'time'), None)
 
@@ -398,7 +424,7 @@ def scale_events(labelled_data: dict, params: list[ParameterMapping], length):
       x = labelled_data[time_input]
       y = next(v for k, v in labelled_data.items() if k != time_input)
 
-      new_x, new_y = downsample_data(x, y, length, resolution)
+      new_x, new_y = downsample_data(x, y, length, resolution, mode)
 
       data = {'pitch': new_y,
               'time': new_x}
@@ -443,49 +469,41 @@ def scale_events(labelled_data: dict, params: list[ParameterMapping], length):
 
       return sources
 
-def light_curve_sources(data, style: BaseStyle, length):
+def light_curve_sources(dataset: Dataset, style: BaseStyle, length):
       
       labelled_data = {}
 
-      if isinstance(data, tuple):
-            
-            labelled_data['time'] = data[0]
-            labelled_data['flux'] = data[1]
-            
-      elif isinstance(data, Path):
+      if dataset.format == 'tuple':
             
+            labelled_data['time'] = dataset['time']
+            labelled_data['flux'] = dataset['flux']
             
-            if data.suffix == '.fits':
+      elif dataset.format == 'fits':
 
-                  lc = lk.read(data)
-                  lc = lc.remove_nans()
-                  
-                  time = ensure_array(lc.time.value)
-                  flux = ensure_array(lc.flux.value)
-                  
-                  labelled_data['time'] = time
-                  labelled_data['flux'] = flux
-
-            elif data.suffix == '.csv':
+            # Remove cadences with no flux, as lightkurve's remove_nans() does
+            dataset = dataset.dropna(['flux'])
+            
+            labelled_data['time'] = dataset['time']
+            labelled_data['flux'] = dataset['flux']
 
-                  df = pd.read_csv(data)
+      elif dataset.format == 'csv':
 
-                  # Remove rows with NaN values in either column
-                  df = df.dropna()
+            # Remove rows with NaN values in any column
+            dataset = dataset.dropna()
 
-                  col1, col2 = df.columns[:2]
-                  
-                  col1 = col1.replace('Time (days)', 'time')
-                  col2 = col2.replace('Flux (electrons per second)', 'flux')
-                  
-                  style_inputs = [mapping.input for mapping in style.parameters]
-                  
-                  # Auto-assign time and flux if there is a style/data input mismatch
-                  col1 = col1 if col1 in style_inputs else 'time'
-                  col2 = col2 if col2 in style_inputs else 'flux'
+            name1, name2 = dataset.names[:2]
+            
+            col1 = name1.replace('Time (days)', 'time')
+            col2 = name2.replace('Flux (electrons per second)', 'flux')
+            
+            style_inputs = [mapping.input for mapping in style.parameters]
             
-                  labelled_data[col1] = df.iloc[:, 0].to_numpy()
-                  labelled_data[col2] = df.iloc[:, 1].to_numpy()
+            # Auto-assign time and flux if there is a style/data input mismatch
+            col1 = col1 if col1 in style_inputs else 'time'
+            col2 = col2 if col2 in style_inputs else 'flux'
+      
+            labelled_data[col1] = dataset[name1]
+            labelled_data[col2] = dataset[name2]
 
       is_scale = ((style.harmony and ' ' in style.harmony) or (style.preset == 'staccato'))
 
@@ -504,7 +522,7 @@ def light_curve_sources(data, style: BaseStyle, length):
             if mapping.output == 'pitch':
                   if is_scale:
                         # Return Events type for scale mapping
-                        return scale_events(labelled_data, params_copy, length)
+                        return scale_events(labelled_data, params_copy, length, style.downsampling)
                   else:
                         # Change pitch for pitch_shift if we want Objects type
                         mapping.output = 'pitch_shift'
@@ -538,25 +556,33 @@ def light_curve_sources(data, style: BaseStyle, length):
                   p_lims[mapping.output] = mapping.output_range
       
       
+      # Evolving parameters only need CONTROL_RATE values per second, however long the data is
+      n_control = int(CONTROL_RATE * length)
+
+      if 'time_evo' in data_dict and len(data_dict['time_evo'][0]) > n_control:
+
+            evolving = [key for key, values in data_dict.items() if key != 'pitch' and isinstance(values[0], np.ndarray)]
+
+            # Fix percentile limits to the full data first, so resampling doesn't change them
+            for key in evolving:
+                  m_lims[key] = absolute_lims(data_dict[key][0], m_lims[key], funcs.get(key))
+
+            resampled = resample(data_dict['time_evo'][0], {key: data_dict[key][0] for key in evolving}, n_control)
+
+            for key in evolving:
+                  data_dict[key] = [resampled[key]]*len(pitches)
+      
       sources = Objects(data_dict.keys())
       sources.fromdict(data_dict)
       sources.apply_mapping_functions(map_funcs=funcs, map_lims=m_lims, param_lims=p_lims)
 
       return sources
 
-def downsample_data(x, y, length_in_sec, resolution):
+def downsample_data(x, y, length_in_sec, resolution, mode='mean'):
     
-    old_n = len(x)
     new_n = int(resolution * length_in_sec)
 
-    if old_n <= new_n:
-        return x, y
-
-    bins = np.array_split(y, new_n)
-    downsampled_y = np.array([float(np.mean(b)) for b in bins])
-    downsampled_x = np.linspace(x[0], x[-1], len(downsampled_y))
-
-    return downsampled_x, downsampled_y
+    return downsample(x, y, new_n, mode)
 
 
 def normalise(array):
@@ -0,0 +1,185 @@
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from pathlib import Path
+from paths import TMP_DIR
+from context import session_id_var
+from config import RENDER_WORKERS
+import multiprocessing, threading, traceback, json, uuid, os, re, time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Job states, in the order a job moves through them
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+
+# Job files older than this are removed (e.g. jobs whose result was never collected)
+JOB_TTL_SECONDS = 3600
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    Get the process pool used to run jobs, creating it on first use.
+    Processes are spawned rather than forked, as the API process runs threads.
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            logger.info(f"Started job pool with {RENDER_WORKERS} workers")
+
+    return _pool
+
+
+def shutdown_pool():
+    """Stop the job pool, cancelling any jobs that haven't started."""
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def job_path(session_id: str, job_id: str) -> Path:
+    return TMP_DIR / session_id / 'jobs' / f'{job_id}.json'
+
+
+def write_job(session_id: str, job_id: str, status: str, **fields):
+    """
+    Record the state of a job in the session directory, so that any API worker can report on it.
+    """
+    path = job_path(session_id, job_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    state = {'job_id': job_id, 'status': status, **fields}
+
+    # Write then rename, so readers never see a partially written file.
+    # The API and pool processes both write job states, so each write has its own temporary file
+    tmp_path = path.with_name(f'.{job_id}.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def delete_job(job_id: str):
+    """Remove a job's file from the current session, once its result has been collected."""
+    session_id = session_id_var.get()
+
+    if session_id and re.fullmatch(r'[0-9a-f]{32}', job_id):
+        job_path(session_id, job_id).unlink(missing_ok=True)
+
+
+def expire_jobs(session_id: str, ttl_seconds: float = JOB_TTL_SECONDS):
+    """Remove a session's job files that haven't been updated for ttl_seconds."""
+    cutoff = time.time() - ttl_seconds
+
+    for path in (TMP_DIR / session_id / 'jobs').glob('*.json'):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def read_job(job_id: str) -> dict:
+    """
+    Get the state of a job belonging to the current session.
+
+    :param job_id: ID returned when the job was submitted
+    :type job_id: str
+
+    :return: The job state, with at least 'job_id' and 'status' keys
+    :rtype: dict
+    """
+    session_id = session_id_var.get()
+
+    if not session_id:
+        raise HTTPException(status_code=400, detail="No session cookie found")
+
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    try:
+        with open(job_path(session_id, job_id), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+
+def run_job(session_id: str, job_id: str, func, args: tuple):
+    """
+    Run a job inside a pool process, recording its progress and result.
+    """
+    # Pool processes don't share the request context, so restore the session
+    session_id_var.set(session_id)
+    write_job(session_id, job_id, RUNNING)
+
+    try:
+        result = func(*args)
+    except Exception as e:
+        logger.error(f"Job {job_id} failed:\n" + traceback.format_exc())
+        detail = e.detail if isinstance(e, HTTPException) else f"{type(e).__name__}: {str(e)}"
+        write_job(session_id, job_id, ERROR, error=detail)
+        return
+
+    write_job(session_id, job_id, DONE, result=result)
+
+
+def submit_job(func, *args, on_failure=None) -> str:
+    """
+    Queue a function to run in the job pool for the current session.
+
+    :param func: Module-level function to run (must be picklable); its return value is the job result
+    :param args: Arguments to call func with
+    :param on_failure: Called (in this process) if the job is cancelled or its pool process dies,
+        which skips any cleanup the job itself would have done
+
+    :return: The ID of the new job
+    :rtype: str
+    """
+    session_id = session_id_var.get()
+
+    if not session_id:
+        raise HTTPException(status_code=400, detail="No session cookie found")
+
+    # Jobs are only looked at by their session, so clear out its old ones as it starts new ones
+    expire_jobs(session_id)
+
+    job_id = uuid.uuid4().hex
+    write_job(session_id, job_id, QUEUED)
+
+    try:
+        future = get_pool().submit(run_job, session_id, job_id, func, args)
+    except BrokenProcessPool:
+        # A pool process died, which leaves the whole pool unusable, so start a new one
+        logger.warning("Job pool was broken, restarting it")
+        shutdown_pool()
+        future = get_pool().submit(run_job, session_id, job_id, func, args)
+
+    def on_done(f: Future):
+        # Catch failures where the pool process couldn't record the error itself (e.g. it crashed)
+        if f.cancelled():
+            write_job(session_id, job_id, ERROR, error='Job cancelled')
+        elif f.exception() is not None:
+            logger.error(f"Job {job_id} crashed: {f.exception()}")
+            write_job(session_id, job_id, ERROR, error=f"{type(f.exception()).__name__}: {str(f.exception())}")
+        else:
+            return
+
+        if on_failure is not None:
+            on_failure()
+
+    future.add_done_callback(on_done)
+
+    return job_id
@@ -1,9 +1,9 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
 from pathlib import Path
-from paths import TMP_DIR, STYLE_FILES_DIR, SUGGESTED_DATA_DIR, SAMPLES_DIR
+from paths import TMP_DIR, STYLE_FILES_DIR, SUGGESTED_DATA_DIR, SAMPLES_DIR, CACHE_DIR
 from context import session_id_var
-import logging, requests, os, base64, hashlib, json, gc, threading
+import logging, os, base64, hashlib, json, gc, threading
 
 import lightkurve as lk
 from lightkurve import LightCurve
@@ -15,16 +15,23 @@ from matplotlib.figure import Figure
 import pandas as pd
 from io import BytesIO
 from concurrent.futures import ThreadPoolExecutor
-from astroquery.simbad import Simbad
 from astroquery.mast import Observations
 from scipy.ndimage import gaussian_filter1d
-from request_models import StarQuery, DataRequest, DownloadRequest, PlotRequest, RefineRequest
+from request_models import StarQuery, DataRequest, DownloadRequest, PlotRequest, RefineRequest, SeriesRequest
 from utils import resolve_file, is_number
+from dataset import load_dataset, data_info
+from downsampling import decimate_for_plot
+from cache import FileCache, MemoryCache, link_or_copy
+from downloads import download_to_cache
+from config import MAST_DOWNLOAD_URL, PREFETCH_MAX_RESULTS
+from simbad_cache import resolve_star
+from prefetch import start_prefetch, cancel_prefetch
 
 
 router = APIRouter(prefix='/light-curves')
 
-executor = ThreadPoolExecutor(max_workers=4)
+# Each search runs a thread per identifier
+executor = ThreadPoolExecutor(max_workers=8)
 
 CATEGORY = 'light_curves'
 
@@ -34,47 +41,77 @@ STARS_DIR = SUGGESTED_DATA_DIR / CATEGORY
 logging.basicConfig(level=logging.DEBUG)
 LOG = logging.getLogger(__name__)
 
+# Points kept per pixel of plot width, above 1 so plots stay sharp on high-DPI screens
+PLOT_OVERSAMPLE = 2
+
+# Light curves downloaded from MAST, shared by all sessions and linked into each session's directory
+DOWNLOAD_CACHE_MAX_MB = 4096
+
+DOWNLOAD_CACHE = FileCache(
+    cache_dir=CACHE_DIR / 'downloads',
+    max_bytes=DOWNLOAD_CACHE_MAX_MB * 1024 * 1024
+)
+
+# Lightkurve search results per (identifier, authors), so searches with other mission filters reuse them
+SEARCH_CACHE_TTL_SECONDS = 3600
+
+SEARCH_CACHE = MemoryCache(
+    max_bytes=32 * 1024 * 1024,
+    ttl_seconds=SEARCH_CACHE_TTL_SECONDS
+)
+
+
+def run_lightkurve_search(ident, author, cancel_event: threading.Event):
+    """
+    Search lightkurve for the light curves of one identifier, reusing recent results for the same search.
+
+    - **ident**: SIMBAD identifier, e.g. 'TIC 346783960'
+    - **author**: Pipeline author(s) to search for
+    - **cancel_event**: Set to cancel the search
+    - Returns: List of result metadata, or None if cancelled
+    """
+    cache_key = (ident, author)
+    cached = SEARCH_CACHE.get(cache_key)
+
+    if cached is not None:
+        return cached
 
-def run_lightkurve_search(idents, authors, cancel_event: threading.Event):
-    
     # Set a timeout on MAST requests
     Observations.TIMEOUT = 10 
 
-    results_metadata = []
+    # Check for user cancelling search
+    if cancel_event.is_set():
+        LOG.warning(f'Search cancelled before querying {ident}')
+        return None
 
-    for ident in idents:
+    try:
+        search_result = lk.search_lightcurve(
+        ident,
+        author=author,
+        limit=20    # Max number of results to return (per ident)
+        )
+    except Exception as e:
+        LOG.warning(f"Search failed for {ident}: {e}")
+        return []
 
-        # Check for user cancelling search
-        if cancel_event.is_set():
-            LOG.warning('Search cancelled inside thread')
-            return None
+    results_metadata = []
 
-        id_type = ident.split(" ")[0]
+    for row in search_result.table:
+        results_metadata.append({
+            "mission": str(row.get("project")),
+            "exposure": int(row.get("exptime")),
+            "pipeline": str(row.get("author")),
+            "year": int(row.get("year")),
+            "period": str(row.get("mission")),
+            "dataURI": str(row.get("dataURI")),
+        })
 
-        # Search lightkurve using all idents
-        try:
-            search_result = lk.search_lightcurve(
-            ident,
-            author=authors[id_type],
-            limit=20    # Max number of results to return (per ident)
-            )
-        except Exception as e:
-            LOG.warning(f"Search failed for {ident}: {e}")
-            continue
-
-        if cancel_event.is_set():
-            LOG.warning(f'Search cancelled after {idents.index(ident)+1} lightkurve query')
-            return None
-
-        for row in search_result.table:
-            results_metadata.append({
-                "mission": str(row.get("project")),
-                "exposure": int(row.get("exptime")),
-                "pipeline": str(row.get("author")),
-                "year": int(row.get("year")),
-                "period": str(row.get("mission")),
-                "dataURI": str(row.get("dataURI")),
-            })
+    # Cache even if cancelled meanwhile, the results are still good for the next search
+    SEARCH_CACHE.put(cache_key, results_metadata, len(json.dumps(results_metadata)))
+
+    if cancel_event.is_set():
+        LOG.warning(f'Search cancelled after querying {ident}')
+        return None
 
     return results_metadata
 
@@ -85,11 +122,16 @@ async def search_lightcurves(query: StarQuery, request: Request):
     """
     Search lightcurves in the lightkurve package, given the name of a star.
 
-    - **query**: The query, containing the star name as a string
+    - **query**: The query, containing the star name as a string, and whether to prefetch the top results
     - Returns: JSON object containing a list of results
     """
+
+    # A new search means the session has moved on from the last one's results
+    session_id = session_id_var.get()
+    cancel_prefetch(session_id)
     
-    idents, ra, dec = get_identifiers(query)
+    # SIMBAD queries block, so run them off the event loop
+    idents, ra, dec = await asyncio.to_thread(get_identifiers, query)
     
     print('ra: ' + str(ra))
     print('dec: ' + str(dec))
@@ -120,29 +162,45 @@ async def search_lightcurves(query: StarQuery, request: Request):
     
     LOG.info(f"Search started for {query.star_name}")
 
-    cancel_event = threading.Event()
     loop = asyncio.get_running_loop()
 
-    task = loop.run_in_executor(
-        executor,
-        run_lightkurve_search,
-        idents,
-        authors,
-        cancel_event
-    )
+    # Search every identifier at once, each with its own cancellation
+    cancel_events = [threading.Event() for _ in idents]
+
+    tasks = [
+        loop.run_in_executor(
+            executor,
+            run_lightkurve_search,
+            ident,
+            authors[ident.split(" ")[0]],
+            cancel_event
+        )
+        for ident, cancel_event in zip(idents, cancel_events)
+    ]
 
     try:
-        results_metadata = await asyncio.wait_for(task, timeout=20)
+        searches = await asyncio.wait_for(asyncio.gather(*tasks), timeout=20)
 
-        if results_metadata is None:
+        if any(results is None for results in searches):
             raise HTTPException(status_code=499, detail='Search cancelled')
+
+        # Keep the results in identifier order
+        results_metadata = [result for results in searches for result in results]
+
         if len(results_metadata) == 0:
             raise HTTPException(status_code=400, detail=f'No {formatted} light curves found for {query.star_name}.')
+
+        if query.prefetch:
+            start_prefetch(session_id, [
+                lambda data_uri=result['dataURI']: prefetch_lightcurve(data_uri)
+                for result in prefetch_candidates(results_metadata)
+            ])
         
         return {"results": results_metadata, "ra": ra, "dec": dec}
 
     except asyncio.TimeoutError:
-        cancel_event.set()
+        for cancel_event in cancel_events:
+            cancel_event.set()
         raise HTTPException(status_code=408, detail=f"Search for {query.star_name} timed out")
 
 
@@ -152,23 +210,14 @@ def get_identifiers(query: StarQuery):
     Query SIMBAD for identifiers that are usable in Lightkurve:
     KIC (Kepler), EPIC (K2), TIC (TESS). 
     Filter this according to user-provided filters.
+    SIMBAD results are cached, so repeat searches for a star don't query SIMBAD again.
     """
     try:
-        # Get RA/Dec in case we need it later to position the object on Dome
-        result = Simbad.query_object(query.star_name)
-        if result is None:
+        resolved = resolve_star(query.star_name)
+        if resolved is None:
             return [], None, None
         
-        ra = float(result['ra'][0])
-        dec = float(result['dec'][0])
-        
-        # Get identifiers for lightkurve search
-        ids_table = Simbad.query_objectids(query.star_name)
-        if ids_table is None:
-            return []
-
-        # Convert to a list of plain strings
-        all_ids = ids_table["id"].tolist()
+        all_ids, ra, dec = resolved
 
         prefixes = {
             "TESS": "TIC",
@@ -185,45 +234,65 @@ def get_identifiers(query: StarQuery):
         return result, ra, dec
     
     except Exception as e:
-        print("SIMBAD query failed:", e)
+        LOG.warning(f"SIMBAD query failed: {e}")
         return [], None, None
 
 
-def download_lightcurve(data_uri):
+def prefetch_candidates(results_metadata: list[dict], n: int = PREFETCH_MAX_RESULTS) -> list[dict]:
+    """
+    Get the search results most likely to be looked at next: the most recent, then the longest exposure (i.e. the smallest file).
+    """
+    return sorted(results_metadata, key=lambda result: (-result['year'], -result['exposure']))[:n]
+
+
+def download_key(data_uri: str) -> tuple[str, str]:
+    """
+    Get the cache key (a unique but reproducible filename) and download URL of a light curve.
+    """
+    hash = hashlib.md5(data_uri.encode()).hexdigest()
+    ext = os.path.splitext(data_uri)[-1]
+
+    return f'{hash}{ext}', f'{MAST_DOWNLOAD_URL}?uri={data_uri}'
+
+
+async def prefetch_lightcurve(data_uri: str):
+    """
+    Download a light curve into the shared store, without adding it to the session, so a later /plot/ or /select/ doesn't wait for MAST.
+    """
+    filename, download_url = download_key(data_uri)
+
+    if not DOWNLOAD_CACHE.path_for(filename).exists():
+        await download_to_cache(DOWNLOAD_CACHE, filename, download_url, speculative=True)
+
+
+async def download_lightcurve(data_uri):
     """
     This is a shared function used by both /select-lightcurve/ and /plot-lightcurve/.
     It will give the lightcurve a unique ID, check if it has already been downloaded, and download it if not.
     The purpose of this function is to avoid duplicate downloads (for instance, if a user previews the plot and then selects it for download).
+    Downloads are kept in a shared store, so a light curve already downloaded by any session is linked rather than downloaded again,
+    and concurrent requests for the same light curve share a single download.
 
     - **data_uri**: The URI of the target lightcurve
     - Returns: The filepath of the downloaded lightcurve.
     """
 
     # Create a unique (but reproducible) hash of the URI
-    hash = hashlib.md5(data_uri.encode()).hexdigest()
-    ext = os.path.splitext(data_uri)[-1]
+    filename, download_url = download_key(data_uri)
 
-    filename = f'{hash}{ext}'
     session_id = session_id_var.get()
     filepath = TMP_DIR / session_id / filename
 
-    if not os.path.exists(filepath):
-
-        # Convert URI to downloadable URL
-        download_url = f'https://mast.stsci.edu/api/v0.1/Download/file?uri={data_uri}'
+    if not os.path.exists(filepath) and not DOWNLOAD_CACHE.fetch(filename, filepath):
 
-        # Download and check OK  
-        response = requests.get(download_url)
-        response.raise_for_status()
+        cached = await download_to_cache(DOWNLOAD_CACHE, filename, download_url)
 
-        # Write to file 
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
+        link_or_copy(cached, filepath)
 
     return filepath
 
 @router.post('/plot/')
-def plot_lightcurve(request: DataRequest):
+async def plot_lightcurve(request: DataRequest):
     """
     Download the target light curve (if not already downloaded) and convert it to a png image.
     This function saves the plot to the memory buffer, to increase speed and avoid saving multiple images to disk.
@@ -234,46 +303,89 @@ def plot_lightcurve(request: DataRequest):
 
     # Check if the requested light curve is from a search (with data URI) or a local file.
     if (request.file_ref.startswith('mast:')):
-        filepath = download_lightcurve(request.file_ref)
+        filepath = await download_lightcurve(request.file_ref)
     else:
         filepath = resolve_file(request.file_ref)
 
-    img_base64 = plot_and_format_lc(str(filepath))
+    # Plotting is slow, so keep it off the event loop
+    img_base64 = await asyncio.to_thread(plot_and_format_lc, str(filepath))
 
     return {'image': img_base64}
 
 
 
 
-def plot_and_format_lc(filepath: str):
+def lc_series(filepath: str):
+    """
+    Get the time and flux of a light curve file, with axis labels.
+
+    - **filepath**: Path of a .csv or .fits light curve
+    - Returns: Tuple of (time, flux, x_label, y_label)
+    """
+
+    # Decoded files are cached, so this doesn't parse the file again
+    dataset = load_dataset(filepath)
 
     # Check file extension
     if filepath.endswith('.csv'):
-     
-        df = pd.read_csv(filepath)
         
         # Get column names for labels
-        columns = df.columns.tolist()
+        columns = dataset.names
         x_label = columns[0] if not is_number(columns[0]) else 'Column 1'
         y_label = columns[1] if not is_number(columns[1]) else 'Column 2'
         
-        time = df[columns[0]].values
-        flux = df[columns[1]].values
+        time = dataset[columns[0]]
+        flux = dataset[columns[1]]
         
     elif filepath.endswith('.fits'):
 
         # It's a FITS file
-        lc = lk.read(filepath)
-        time = lc.time.value
-        flux = lc.flux.value
+        time = dataset['time']
+        flux = dataset['flux']
         
         x_label = 'Time (days)'
         y_label = 'Flux (electrons per second)'
 
+    else:
+        raise HTTPException(status_code=400, detail='File extension not supported: ' + Path(filepath).name)
+
+    return time, flux, x_label, y_label
+
+
+def refine_series(time: np.ndarray, flux: np.ndarray, new_range: list[float], sigma: int):
+    """
+    Truncate a light curve to a new time range, and smooth it with a Gaussian filter if sigma > 0.
+    This matches what /save-refined/ does to the saved file.
+
+    - Returns: The refined (time, flux)
+    """
+
+    new_start, new_end = new_range
+
+    in_range = (time >= new_start) & (time <= new_end)
+    time, flux = time[in_range], flux[in_range]
+
+    if sigma > 0:
+        flux = gaussian_filter1d(flux, sigma)
+
+    return time, flux
+
+
+def plot_and_format_lc(filepath: str):
+
+    return plot_series(*lc_series(filepath))
+
+
+def plot_series(time: np.ndarray, flux: np.ndarray, x_label: str, y_label: str):
+
     # Plot and format
     fig = Figure(figsize=(6, 4))
     ax = fig.add_subplot(111)
 
+    # Only the points that change the drawn line are needed, which keeps the SVG small
+    n_columns = int(ax.get_position().width * fig.get_figwidth() * fig.dpi * PLOT_OVERSAMPLE)
+    time, flux = decimate_for_plot(time, flux, n_columns)
+
     ax.plot(
         time,
         flux,
@@ -300,8 +412,92 @@ def plot_and_format_lc(filepath: str):
 
     return img_base64
 
+def series_points(filepath: str, new_range: list[float] | None, points: int):
+    """
+    Get a light curve's time and flux, truncated to a time range and decimated for plotting.
+
+    - **filepath**: Path of a .csv or .fits light curve
+    - **new_range**: Optional [start, end] time range
+    - **points**: Maximum number of points to return
+    - Returns: Tuple of (time, flux, full time range, x_label, y_label)
+    """
+
+    time, flux, x_label, y_label = lc_series(filepath)
+
+    try:
+        time = np.asarray(time, dtype=float)
+        flux = np.asarray(flux, dtype=float)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail='Light curve time and flux must be numeric: ' + Path(filepath).name)
+
+    if time.size == 0:
+        raise HTTPException(status_code=400, detail='Light curve has no data: ' + Path(filepath).name)
+
+    value_range = [float(np.nanmin(time)), float(np.nanmax(time))]
+
+    if new_range:
+        start, end = new_range
+        in_range = (time >= start) & (time <= end)
+        time, flux = time[in_range], flux[in_range]
+
+    # Each pixel column keeps up to 4 points (first, last, min and max)
+    time, flux = decimate_for_plot(time, flux, points // 4)
+
+    return time, flux, value_range, x_label, y_label
+
+
+@router.post('/series/')
+async def get_series(request: SeriesRequest):
+    """
+    Get a light curve as a series of points, for plotting in the browser.
+    The series is decimated to the requested number of points, keeping the shape of the plotted line.
+
+    - **request**: The URI (or file ref) of the light curve, an optional time range, the number of points and the format
+    - Returns: JSON with 'time' and 'flux' lists, or with format 'binary', little-endian float32 time values followed
+      by the same number of flux values. Binary times are relative to the X-Time-Offset header, to keep float32 precision.
+    """
+
+    # Check if the requested light curve is from a search (with data URI) or a local file.
+    if (request.file_ref.startswith('mast:')):
+        filepath = await download_lightcurve(request.file_ref)
+    else:
+        filepath = resolve_file(request.file_ref)
+
+    if request.points < 4:
+        raise HTTPException(status_code=400, detail='Series must have at least 4 points')
+
+    # Reading, masking and decimating are slow for long light curves, so keep them off the event loop
+    time, flux, value_range, x_label, y_label = await asyncio.to_thread(
+        series_points, str(filepath), request.new_range, request.points
+    )
+
+    if request.format == 'binary':
+        offset = float(np.nanmin(time)) if time.size else 0.
+        body = np.concatenate((time - offset, flux)).astype('<f4').tobytes()
+
+        return Response(
+            content=body,
+            media_type='application/octet-stream',
+            headers={
+                'X-Points': str(time.size),
+                'X-Time-Offset': repr(offset),
+                'X-Range': json.dumps(value_range),
+                'X-Labels': json.dumps([x_label, y_label])
+            }
+        )
+
+    # NaNs (breaks in the line) aren't valid JSON, so send them as nulls
+    return {
+        'time': [None if np.isnan(t) else t for t in time.tolist()],
+        'flux': [None if np.isnan(f) else f for f in flux.tolist()],
+        'range': value_range,
+        'x_label': x_label,
+        'y_label': y_label
+    }
+
+
 @router.post('/select-lightcurve/')
-def select_lightcurve(request: DownloadRequest):
+async def select_lightcurve(request: DownloadRequest):
     """
     Download a chosen light curve to the tmp directory, if it hasn't already been.
     This can then be used later to sonify the light curve.
@@ -309,7 +505,7 @@ def select_lightcurve(request: DownloadRequest):
     - **request**: The URI of the chosen light curve
     - Returns: The filename of the downloaded light curve
     """
-    filepath = Path(download_lightcurve(request.data_uri))
+    filepath = Path(await download_lightcurve(request.data_uri))
     file_ref = f'session:{filepath.name}'
     
     return {'file_ref': file_ref}
@@ -320,33 +516,29 @@ def get_range(request: DataRequest):
 
     filepath = str(resolve_file(request.file_ref))
 
-    if filepath.endswith('.fits'):
-        lc = lk.read(filepath)
-        x = lc.time.value
-        value_range = [float(min(x)), float(max(x))]
-
-    elif filepath.endswith('.csv'):
-        df = pd.read_csv(filepath)
-
-        time_col = df.columns[0]
-
-        x = df[time_col].values
-        value_range = [float(min(x)), float(max(x))]
-    else:
+    if not filepath.endswith(('.fits', '.csv')):
         raise HTTPException(status_code=400, detail='File extension not supported: ' + request.file_ref.split(':')[-1])
 
-    return{'range': value_range}
+    # Summarised from the time column alone, without decoding the whole file
+    info = data_info(filepath)
+
+    return{'range': info['range'], 'points': info['points'], 'cadence': info['cadence'], 'nan_fraction': info['nan_fraction']}
 
 
 @router.post('/preview-refined/')
 def preview_refined(request: RefineRequest):
+    """
+    Plot a light curve as it would be refined, without saving the refined file (that waits for /save-refined/).
+    """
 
-    refined = save_refined(request)
+    filepath = str(resolve_file(request.file_ref))
 
-    filepath = str(resolve_file(refined['file_ref']))
+    # Refine the decoded (cached) light curve in memory
+    time, flux, x_label, y_label = lc_series(filepath)
+    time, flux = refine_series(time, flux, request.new_range, request.sigma)
        
     # Plot, format, and convert image to Base64
-    img_base64 = plot_and_format_lc(filepath)
+    img_base64 = plot_series(time, flux, x_label, y_label)
 
     return{'image': img_base64}
 
@@ -367,6 +559,7 @@ def save_refined(request: RefineRequest):
     refined_ref = f'session:{filename}'
     
     if ext == 'fits':
+        # Writing a FITS file needs the full LightCurve, so this can't use the decoded cache
         lc = lk.read(original_filepath)
         lc = lc.truncate(new_start, new_end)
         
@@ -386,7 +579,7 @@ def save_refined(request: RefineRequest):
         lc.to_fits(refined_filepath, overwrite=True)
             
     elif ext == 'csv':
-        df = pd.read_csv(original_filepath)
+        df = pd.DataFrame(load_dataset(original_filepath).columns)
         
         time_col = df.columns[0]
         df_truncated = df[(df[time_col] >= new_start) & (df[time_col] <= new_end)].copy()
@@ -10,10 +10,17 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, JSONResponse
 
-from light_curves import router as light_curve_router
-from constellations import router as constellations_router
+from light_curves import router as light_curve_router, DOWNLOAD_CACHE, SEARCH_CACHE
+from constellations import router as constellations_router, preload_constellations, prerender_constellation_plots, PLOT_CACHE
 from night_sky import router as night_sky_router
-from core import router as core_router
+from core import router as core_router, RENDER_CACHE, PREVIEW_CACHE, prerender_previews
+from dataset import DATASET_CACHE, LIGHT_CURVE_CACHE, DATA_INFO_CACHE
+from extensions import COMPILED_STYLES
+from jobs import shutdown_pool
+from downloads import close_client
+from prefetch import cancel_all_prefetches
+from simbad_cache import seed_suggested_stars
+from sample_bank import compile_all
 from settings import router as settings_router
 from paths import SYNTHS_DIR, SAMPLES_DIR, TMP_DIR, ROOT_DIR
 from sounds import cache_online_assets
@@ -68,12 +75,44 @@ async def lifespan(app: FastAPI):
         # On Windows (local dev), always start the cleanup task
         got_lock = True
 
+    # Warm-ups run in threads, and are kept here so they aren't garbage collected while running
+    warmup_tasks = []
+    warmup_stop = threading.Event()
+
+    def warm_up(func, *args):
+        warmup_tasks.append(asyncio.create_task(asyncio.to_thread(func, *args)))
+
     # First worker to get the lock 
     if got_lock:
         cleanup_task = asyncio.create_task(storage_manager.start_background_cleanup())
 
+        # Decode sample folders into shared banks ahead of the first render that needs them
+        warm_up(compile_all)
+
+        # Pre-render previews of the built-in styles, in a thread so the job pool is only started by the first job
+        warm_up(prerender_previews, warmup_stop)
+
+        # Plot every constellation too
+        warm_up(prerender_constellation_plots, warmup_stop)
+
+        # Resolve the suggested stars with SIMBAD once, so searches for them don't need to
+        warm_up(seed_suggested_stars)
+
+    # Every worker has its own copy of the star catalog, so each parses it (and sorts each constellation's stars) ahead of the first constellation request
+    warm_up(preload_constellations)
+
     yield
 
+    # Threads can't be cancelled, so the long pre-render loops are told to stop after their current item
+    warmup_stop.set()
+    for task in warmup_tasks:
+        task.cancel()
+    await asyncio.gather(*warmup_tasks, return_exceptions=True)
+
+    shutdown_pool()
+    await cancel_all_prefetches()
+    await close_client()
+
     if cleanup_task:
         cleanup_task.cancel()
         try:
@@ -167,6 +206,26 @@ async def cleanup_status():
     }
 
 
+@app.get("/cache/status")
+async def cache_status():
+    """Get usage and hit/miss counters of the shared caches."""
+    return {
+        "renders": RENDER_CACHE.stats(),
+        "previews": PREVIEW_CACHE.stats(),
+        "datasets": DATASET_CACHE.stats(),
+        "data_info": DATA_INFO_CACHE.stats(),
+        "light_curves": LIGHT_CURVE_CACHE.stats(),
+        "downloads": DOWNLOAD_CACHE.stats(),
+        "searches": SEARCH_CACHE.stats(),
+        "constellation_plots": PLOT_CACHE.stats(),
+        "compiled_styles": COMPILED_STYLES.stats()
+    }
+
+
 if __name__ == "__main__":
+    # Job pool processes are spawned, which re-runs this executable when frozen, so hand them over to the pool first
+    import multiprocessing
+    multiprocessing.freeze_support()
+
     import uvicorn
     uvicorn.run(app)
@@ -30,6 +30,8 @@ SUGGESTED_DATA_DIR = BACKEND_DIR / "suggested_data"
 HYG_DATA = SUGGESTED_DATA_DIR / "constellations" / "hyg.csv"
 TMP_DIR = BACKEND_DIR / "tmp"
 TMP_DIR.mkdir(exist_ok=True)
+CACHE_DIR = BACKEND_DIR / "cache"
+CACHE_DIR.mkdir(exist_ok=True)
 SOUND_ASSETS_DIR = BACKEND_DIR / "sound_assets"
 SYNTHS_DIR = SOUND_ASSETS_DIR / "synths"
 SAMPLES_DIR = SOUND_ASSETS_DIR / "samples"
@@ -0,0 +1,69 @@
+from typing import Awaitable, Callable
+from config import PREFETCH_SESSION_CONCURRENCY, PREFETCH_GLOBAL_CONCURRENCY
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Each session's prefetch in progress, so it can be cancelled when the session moves on
+_prefetches: dict[str, asyncio.Task] = {}
+
+# Prefetch downloads running across all sessions
+_global_slots = asyncio.Semaphore(PREFETCH_GLOBAL_CONCURRENCY)
+
+
+def start_prefetch(session_id: str, jobs: list[Callable[[], Awaitable]]):
+    """
+    Run a session's prefetch jobs in the background, replacing any prefetch the session already has running.
+
+    Args:
+        session_id: Session the jobs are prefetching for
+        jobs: Functions starting each prefetch (e.g. a download), in order of priority
+    """
+    cancel_prefetch(session_id)
+
+    if not jobs:
+        return
+
+    task = asyncio.create_task(run_prefetch(session_id, jobs))
+    _prefetches[session_id] = task
+
+    # Only forget the task if it hasn't already been replaced by a newer one
+    task.add_done_callback(lambda _: _prefetches.pop(session_id, None) if _prefetches.get(session_id) is task else None)
+
+
+def cancel_prefetch(session_id: str):
+    """Cancel a session's prefetch, if it has one running."""
+    task = _prefetches.pop(session_id, None)
+
+    if task is not None and not task.done():
+        task.cancel()
+
+
+async def cancel_all_prefetches():
+    """Cancel every session's prefetch and wait for them to stop, e.g. on shutdown."""
+    tasks = list(_prefetches.values())
+    _prefetches.clear()
+
+    for task in tasks:
+        task.cancel()
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_prefetch(session_id: str, jobs: list[Callable[[], Awaitable]]):
+
+    session_slots = asyncio.Semaphore(PREFETCH_SESSION_CONCURRENCY)
+
+    async def run(job: Callable[[], Awaitable]):
+        async with session_slots, _global_slots:
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Nothing is waiting on a prefetch, so a failure only means a cold download later
+                logger.warning(f"Prefetch failed for session {session_id}: {e}")
+
+    # Semaphores are acquired in order, so higher priority jobs start first
+    await asyncio.gather(*(run(job) for job in jobs))
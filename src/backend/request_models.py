@@ -27,6 +27,7 @@ class SonificationRequest(BaseModel):
     system: str
     data_name: str
     observer: Optional[dict]
+    stream: bool = False
     
 #---------- Constellations ----------#
     
@@ -44,6 +45,7 @@ class NStarsRequest(BaseModel):
 class StarQuery(BaseModel):
     star_name: str
     filters: dict
+    prefetch: bool = False
 
 class DownloadRequest(BaseModel):
     data_uri: str
@@ -57,6 +59,12 @@ class RefineRequest(BaseModel):
     file_ref: str
     new_range: list[float]
     sigma: int
+
+class SeriesRequest(BaseModel):
+    file_ref: str
+    new_range: Optional[list[float]] = None
+    points: int = 2000
+    format: Literal['json', 'binary'] = 'json'
     
 #---------- Night Sky ----------#   
 
@@ -0,0 +1,184 @@
+from strauss.generator import Sampler
+from paths import SAMPLES_DIR, CACHE_DIR
+from cache import make_key
+from pathlib import Path
+import numpy as np
+import hashlib, json, os, shutil, threading, uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Decoded sample folders, stored as one float32 array plus an index of where each note starts
+BANKS_DIR = CACHE_DIR / 'sample_banks'
+
+# Banks already opened in this process, keyed by bank directory
+_open_banks = {}
+_banks_lock = threading.Lock()
+
+
+class SampleFunc:
+    """
+    Linearly interpolate a sample at fractional sample indices, with silence outside it.
+    Equivalent to the interp1d that strauss builds for each sample, without copying the sample data.
+    """
+
+    def __init__(self, values: np.ndarray):
+        self.values = values
+
+    def __call__(self, s):
+        s = np.asarray(s, dtype=float)
+        n = self.values.size
+
+        i = np.floor(s).astype(int)
+        frac = s - i
+        lower = self.values[np.clip(i, 0, n-1)]
+        upper = self.values[np.clip(i+1, 0, n-1)]
+
+        values = lower + (upper - lower) * frac
+
+        return np.where((s >= 0) & (s <= n-1), values, 0.)
+
+
+class SampleBank:
+    """Memory-mapped samples for one sample folder, shared between every Sampler using it."""
+
+    def __init__(self, bank_dir: Path):
+        with open(bank_dir / 'index.json', 'r') as f:
+            index = json.load(f)
+
+        self.samprate = index['samprate']
+        data = np.load(bank_dir / 'samples.npy', mmap_mode='r')
+
+        self.samples = {}
+        self.samplens = {}
+        for note, (offset, length) in index['notes'].items():
+            self.samples[note] = SampleFunc(data[offset:offset+length])
+            self.samplens[note] = length
+
+
+class BankSampler(Sampler):
+    """Sampler that plays samples from a SampleBank instead of decoding audio files."""
+
+    def __init__(self, bank: SampleBank, params=None):
+        self.bank = bank
+        super().__init__({}, params, bank.samprate)
+
+    def load_samples(self):
+        self.samples = self.bank.samples
+        self.samplens = self.bank.samplens
+
+
+def source_signature(sample_path: Path) -> str:
+    """Identify the current contents of a sample folder, so stale banks are recompiled."""
+    files = sorted(f for f in sample_path.iterdir() if f.is_file())
+    return make_key([(f.name, f.stat().st_size, f.stat().st_mtime_ns) for f in files])[:16]
+
+
+def bank_dir_for(sample_path: Path) -> Path:
+    return BANKS_DIR / f'{sample_path.name}-{source_signature(sample_path)}'
+
+
+def decode_samples(sample_path: Path, samprate: int) -> dict:
+    """
+    Decode a sample folder with strauss, exactly as a Sampler would.
+
+    Returns:
+        Dict of note name to normalised sample values
+    """
+    files = sorted(f for f in sample_path.iterdir() if f.is_file())
+    soundfont = next((f for f in files if f.suffix == '.sf2'), None)
+
+    sampler = Sampler(str(soundfont), sf_preset=1, samprate=samprate) if soundfont else Sampler(str(sample_path), samprate=samprate)
+
+    # The normalised, DC-removed values are held by the interpolation function of each note
+    return {note: func.y for note, func in sampler.samples.items()}
+
+
+def compile_bank(sample_path: Path, samprate: int = 48000) -> Path:
+    """
+    Compile a sample folder (of WAVs or a .sf2) into a bank, if it isn't already compiled.
+
+    Args:
+        sample_path: Folder in the samples directory
+        samprate: Sample rate to resample to, matching the Sonification
+
+    Returns:
+        Directory of the compiled bank
+    """
+    bank_dir = bank_dir_for(sample_path)
+
+    if bank_dir.exists():
+        return bank_dir
+
+    logger.info(f"Compiling sample bank for {sample_path.name}")
+
+    notes = decode_samples(sample_path, samprate)
+
+    # Soundfont notes with sharp and flat names share samples, so only store those once
+    index = {}
+    chunks = []
+    offset = 0
+    stored = {}
+    for note, values in notes.items():
+        digest = hashlib.sha1(values.tobytes()).hexdigest()
+        if digest in stored:
+            index[note] = index[stored[digest]]
+            continue
+
+        stored[digest] = note
+        index[note] = [offset, int(values.size)]
+        chunks.append(values.astype('float32'))
+        offset += values.size
+
+    # Build in a temporary directory and rename, so other workers never open a partial bank
+    tmp_dir = BANKS_DIR / f'.{bank_dir.name}.{uuid.uuid4().hex}'
+    tmp_dir.mkdir(parents=True)
+
+    np.save(tmp_dir / 'samples.npy', np.concatenate(chunks) if chunks else np.zeros(0, dtype='float32'))
+    with open(tmp_dir / 'index.json', 'w') as f:
+        json.dump({'source': sample_path.name, 'samprate': samprate, 'notes': index}, f)
+
+    try:
+        os.rename(tmp_dir, bank_dir)
+    except OSError:
+        # Another worker compiled it first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return bank_dir
+
+    # Remove banks compiled from older versions of the folder
+    for old in BANKS_DIR.glob(f'{sample_path.name}-*'):
+        if old != bank_dir and old.name.rsplit('-', 1)[0] == sample_path.name:
+            shutil.rmtree(old, ignore_errors=True)
+
+    return bank_dir
+
+
+def load_bank(sample_path: Path | str) -> SampleBank:
+    """
+    Get the sample bank for a sample folder, compiling it first if needed.
+
+    Args:
+        sample_path: Folder in the samples directory
+
+    Returns:
+        The memory-mapped SampleBank
+    """
+    bank_dir = compile_bank(Path(sample_path))
+
+    with _banks_lock:
+        if bank_dir not in _open_banks:
+            _open_banks[bank_dir] = SampleBank(bank_dir)
+
+        return _open_banks[bank_dir]
+
+
+def compile_all():
+    """Compile a bank for every folder in the samples directory."""
+    for sample_path in sorted(SAMPLES_DIR.iterdir()):
+        if sample_path.is_dir():
+            compile_bank(sample_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    compile_all()
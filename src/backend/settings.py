@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from typing import Literal
 from paths import TMP_DIR
 from pathlib import Path
 from context import session_id_var
@@ -7,28 +8,37 @@ import yaml
 
 router = APIRouter(prefix='/settings')
 
+DEFAULT_SETTINGS = {"data_resolution": 10, "downsampling": "mean"}
+
 class UserSettings(BaseModel):
     data_resolution: int
+    downsampling: Literal['mean', 'minmax', 'lttb'] = 'mean'
 
 def load_settings_from_file():
     """Load settings from YAML file"""
 
     session_id = session_id_var.get()
-    settings_file = TMP_DIR / session_id / 'settings.yml'
+    session_dir = TMP_DIR / session_id
+    settings_file = session_dir / 'settings.yml'
+
+    if not session_dir.exists():
+        # Not rendering for a session (e.g. pre-rendering previews), so use the defaults
+        return dict(DEFAULT_SETTINGS)
 
     if not settings_file.exists():
         # Create default settings if file doesn't exist
-        default_settings = {"data_resolution": 10}
+        default_settings = dict(DEFAULT_SETTINGS)
         save_settings_to_file(default_settings, settings_file)
         return default_settings
     
     try:
         with open(settings_file, 'r') as file:
             settings = yaml.safe_load(file) or {}
-            return settings
+            # Fill in settings added since the file was saved
+            return {**DEFAULT_SETTINGS, **settings}
     except Exception as e:
         print(f"Error loading settings: {e}")
-        return {"data_resolution": 10}
+        return dict(DEFAULT_SETTINGS)
 
 
 def save_settings_to_file(settings: dict, settings_path: Path):
@@ -58,7 +68,7 @@ async def save_settings(settings: UserSettings):
         current_settings = load_settings_from_file()
         
         # Update with new values
-        current_settings.update(settings.model_dump())
+        current_settings.update(settings.model_dump(exclude_unset=True))
         
         session_id = session_id_var.get()
         settings_path = TMP_DIR / session_id / 'settings.yml'
@@ -0,0 +1,159 @@
+from astroquery.simbad import Simbad
+from pathlib import Path
+from paths import CACHE_DIR, SUGGESTED_DATA_DIR
+from contextlib import closing
+import json, sqlite3, time, yaml
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Star names resolved by SIMBAD, shared by all workers and kept between restarts
+SIMBAD_DB = CACHE_DIR / 'simbad.sqlite3'
+
+# How long resolved names (and names SIMBAD didn't know) are trusted before asking SIMBAD again
+SIMBAD_TTL_SECONDS = 30 * 24 * 3600
+NOT_FOUND_TTL_SECONDS = 24 * 3600
+
+
+def normalise_name(star_name: str) -> str:
+    """Normalise a star name so that e.g. 'Beta  Persei' and 'beta persei' share a cache entry."""
+    return ' '.join(star_name.lower().split())
+
+
+def connect() -> sqlite3.Connection:
+
+    conn = sqlite3.connect(SIMBAD_DB, timeout=10)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stars (
+            name TEXT PRIMARY KEY,
+            found INTEGER NOT NULL,
+            ra REAL,
+            dec REAL,
+            identifiers TEXT,
+            fetched REAL NOT NULL
+        )
+        """
+    )
+
+    return conn
+
+
+def lookup(star_name: str) -> dict | None:
+    """
+    Get the cached SIMBAD resolution of a star name, if it hasn't expired.
+
+    Returns:
+        Dict with 'found', 'ra', 'dec' and 'identifiers', or None if not cached
+    """
+    with closing(connect()) as conn:
+        row = conn.execute(
+            "SELECT found, ra, dec, identifiers, fetched FROM stars WHERE name = ?",
+            (normalise_name(star_name),)
+        ).fetchone()
+
+    if row is None:
+        return None
+
+    found, ra, dec, identifiers, fetched = row
+    ttl = SIMBAD_TTL_SECONDS if found else NOT_FOUND_TTL_SECONDS
+
+    if time.time() - fetched > ttl:
+        return None
+
+    return {
+        'found': bool(found),
+        'ra': ra,
+        'dec': dec,
+        'identifiers': json.loads(identifiers) if identifiers else []
+    }
+
+
+def store(star_name: str, ra: float | None, dec: float | None, identifiers: list[str] | None):
+    """
+    Cache the SIMBAD resolution of a star name, or that SIMBAD doesn't know it if identifiers is None.
+    """
+    found = identifiers is not None
+
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO stars (name, found, ra, dec, identifiers, fetched) VALUES (?, ?, ?, ?, ?, ?)",
+            (normalise_name(star_name), int(found), ra, dec, json.dumps(identifiers) if found else None, time.time())
+        )
+
+
+def query_simbad(star_name: str) -> tuple[list[str], float, float] | None:
+    """
+    Query SIMBAD for a star's position and all of its identifiers.
+
+    Returns:
+        (identifiers, ra, dec), or None if SIMBAD doesn't know the name
+    """
+    # Get RA/Dec in case we need it later to position the object on Dome
+    result = Simbad.query_object(star_name)
+    if result is None or len(result) == 0:
+        return None
+
+    ra = float(result['ra'][0])
+    dec = float(result['dec'][0])
+
+    ids_table = Simbad.query_objectids(star_name)
+
+    # Convert to a list of plain strings
+    identifiers = [str(i) for i in ids_table['id'].tolist()] if ids_table is not None else []
+
+    return identifiers, ra, dec
+
+
+def resolve_star(star_name: str) -> tuple[list[str], float, float] | None:
+    """
+    Resolve a star name to its identifiers and position, asking SIMBAD only if it isn't cached.
+
+    Returns:
+        (identifiers, ra, dec), or None if SIMBAD doesn't know the name
+    """
+    cached = lookup(star_name)
+
+    if cached is not None:
+        if not cached['found']:
+            return None
+        return cached['identifiers'], cached['ra'], cached['dec']
+
+    # Query failures (e.g. SIMBAD being down) raise here, so only genuinely unknown names are cached as such
+    resolved = query_simbad(star_name)
+
+    if resolved is None:
+        store(star_name, None, None, None)
+        return None
+
+    identifiers, ra, dec = resolved
+    store(star_name, ra, dec, identifiers)
+
+    return resolved
+
+
+def seed_suggested_stars(stars_dir: Path = SUGGESTED_DATA_DIR / 'light_curves'):
+    """
+    Make sure the suggested light curve stars are cached, so searches for them don't need SIMBAD.
+    Each star is resolved once, then cached under any 'aliases' in its YAML too.
+    """
+    for star_file in sorted(stars_dir.glob('*.yml')):
+        try:
+            with open(star_file, 'r') as f:
+                star = yaml.safe_load(f)
+
+            aliases = [alias for alias in star.get('aliases', []) if lookup(alias) is None]
+
+            if lookup(star['name']) is not None and not aliases:
+                continue
+
+            resolved = resolve_star(star['name'])
+            if resolved is None:
+                continue
+
+            identifiers, ra, dec = resolved
+            for alias in aliases:
+                store(alias, ra, dec, identifiers)
+
+        except Exception as e:
+            logger.warning(f"Could not cache SIMBAD identifiers for {star_file.name}: {e}")
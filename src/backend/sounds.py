@@ -1,12 +1,135 @@
 from paths import SYNTHS_DIR, SAMPLES_DIR
 from config import GITHUB_USER, GITHUB_REPO
-import httpx
+from pathlib import Path
+import httpx, threading, os, time
 from pydantic import BaseModel
 
 class SoundInfo(BaseModel):
     name: str
     composable: bool
     downloaded: bool
+
+
+class LocalSound(BaseModel):
+    name: str
+    folder: str
+    path: Path
+    notes: frozenset[str]
+    composable: bool
+
+
+class SoundRegistry:
+    """
+    Index of the sounds in the sound_assets directory, built once and rebuilt
+    whenever a sound is added or removed in the synths or samples directories.
+    """
+
+    # Seconds between checks of the sound directories for changes
+    CHECK_INTERVAL = 1.
+
+    def __init__(self):
+        self._sounds: dict[str, LocalSound] | None = None
+        self._duplicates: set[str] = set()
+        self._signature = None
+        self._checked = 0.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def signature(self) -> tuple:
+        """
+        Get the modification times of the sound directories and of each sample folder, which change when a sound
+        is added, removed or renamed. Files replaced in place don't change these, so call refresh() after that.
+        """
+        entries = [(str(d), d.stat().st_mtime_ns) for d in (SYNTHS_DIR, SAMPLES_DIR)]
+
+        with os.scandir(SAMPLES_DIR) as it:
+            for entry in it:
+                if entry.is_dir():
+                    entries.append((entry.path, entry.stat().st_mtime_ns))
+
+        return tuple(sorted(entries))
+
+    def sounds(self) -> dict[str, LocalSound]:
+        """
+        Get all local sounds, rebuilding the index if the sound directories have changed.
+        The directories are checked at most once every CHECK_INTERVAL seconds.
+
+        Returns:
+            Dict of sound name to LocalSound
+        """
+        with self._lock:
+            now = time.monotonic()
+
+            if self._sounds is not None and now - self._checked < self.CHECK_INTERVAL:
+                return self._sounds
+
+            signature = self.signature()
+            self._checked = now
+
+            if self._sounds is None or signature != self._signature:
+                self._sounds, self._duplicates = self.scan()
+                self._signature = signature
+                self._generation += 1
+
+            return self._sounds
+
+    def get(self, name: str) -> LocalSound | None:
+        return self.sounds().get(name)
+
+    def is_duplicate(self, name: str) -> bool:
+        """Check whether a sound name is used by both a synth and a sample folder."""
+        self.sounds()
+        return name in self._duplicates
+
+    def generation(self) -> int:
+        """
+        Get a number that changes whenever the index is rebuilt, to key anything derived from the sounds.
+        """
+        self.sounds()
+        return self._generation
+
+    def refresh(self):
+        """Rebuild the index on next use, e.g. after a sound pack is downloaded."""
+        with self._lock:
+            self._sounds = None
+
+    def scan(self) -> tuple[dict[str, LocalSound], set[str]]:
+
+        sounds = {}
+        duplicates = set()
+
+        for f in SYNTHS_DIR.iterdir():
+            if f.is_file():
+                composable = f.stem != 'White Noise'
+                sounds[f.stem] = LocalSound(name=f.stem, folder='synths', path=f, notes=frozenset(), composable=composable)
+
+        for f in SAMPLES_DIR.iterdir():
+            if f.is_dir():
+                name = f.stem
+
+                files = [file for file in f.iterdir() if file.is_file()]
+
+                # Composable if:
+                # 1) The directory contains a .sf2 file
+                # 2) OR the directory contains multiple files
+                composable = (
+                    any(file.suffix == ".sf2" for file in files)
+                    or len(files) > 1
+                )
+
+                # Sample files are named by note, e.g. 'C4.wav' or 'harp_C4.wav'
+                notes = frozenset(file.stem.split('_')[-1] for file in files)
+
+                if name in sounds:
+                    duplicates.add(name)
+                    continue
+
+                sounds[name] = LocalSound(name=name, folder='samples', path=f, notes=notes, composable=composable)
+
+        return sounds, duplicates
+
+
+sound_registry = SoundRegistry()
     
 
 asset_cache = []
@@ -62,33 +185,8 @@ def format_name(file_name: str):
     return name
 
 def local_sounds():
-      
-    local_sounds = []
-
-    for f in SYNTHS_DIR.iterdir():
-        if f.is_file():
-            composable = f.stem != 'White Noise'
-            sound = SoundInfo(name=f.stem, composable=composable, downloaded=True)
-            local_sounds.append(sound)
-
-    for f in SAMPLES_DIR.iterdir():
-        if f.is_dir():
-            name = f.stem
-    
-            files = [file for file in f.iterdir() if file.is_file()]
-
-            # Composable if:
-            # 1) The directory contains a .sf2 file
-            # 2) OR the directory contains multiple files
-            composable = (
-                any(file.suffix == ".sf2" for file in files)
-                or len(files) > 1
-            )
-
-            sound = SoundInfo(name=name, composable=composable, downloaded=True)
-            local_sounds.append(sound)
-      
-    return local_sounds
+
+    return [SoundInfo(name=sound.name, composable=sound.composable, downloaded=True) for sound in sound_registry.sounds().values()]
 
 def all_sounds():
 
@@ -0,0 +1,78 @@
+from pathlib import Path
+from paths import HYG_DATA
+import numpy as np
+import pandas as pd
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StarCatalog:
+    """The HYG star catalog, parsed once and indexed by Hipparcos ID and IAU constellation code."""
+
+    def __init__(self, stars: pd.DataFrame, version: tuple = ()):
+        """
+        Initialize catalog.
+
+        Args:
+            stars: One row per star, in catalog order
+            version: Identifies the catalog file the stars were read from, so results derived from it can be cached
+        """
+        self.stars = stars.reset_index(drop=True)
+        self.version = version
+
+        # Row positions of each Hipparcos ID and constellation, in catalog order
+        self.hip_rows = self.stars.groupby('hip', sort=False).indices
+        self.con_rows = self.stars.groupby('con', sort=False).indices
+
+    def __len__(self) -> int:
+        return len(self.stars)
+
+    def by_hip(self, hip_ids) -> pd.DataFrame:
+        """
+        Get the stars with the given Hipparcos IDs, in catalog order (IDs not in the catalog are skipped).
+        """
+        rows = [self.hip_rows[hip] for hip in set(hip_ids) if hip in self.hip_rows]
+        rows = np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=int)
+
+        return self.stars.iloc[rows].copy()
+
+    def by_constellation(self, con: str) -> pd.DataFrame:
+        """
+        Get the stars within a constellation's boundaries, in catalog order.
+        """
+        rows = self.con_rows.get(con, np.empty(0, dtype=int))
+
+        return self.stars.iloc[rows].copy()
+
+
+_catalog: StarCatalog | None = None
+_catalog_lock = threading.Lock()
+
+
+def catalog_version(filepath: Path = HYG_DATA) -> tuple:
+    stat = filepath.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_catalog(filepath: Path = HYG_DATA) -> StarCatalog:
+    """
+    Get the star catalog, parsing it on first use (and again only if the file changes).
+    """
+    global _catalog
+
+    version = catalog_version(filepath)
+
+    if _catalog is not None and _catalog.version == version:
+        return _catalog
+
+    with _catalog_lock:
+
+        # Another thread may have loaded it while this one waited
+        if _catalog is None or _catalog.version != version:
+            _catalog = StarCatalog(pd.read_csv(filepath), version)
+            logger.info(f"Loaded {len(_catalog)} stars from {filepath.name}")
+
+    return _catalog
+
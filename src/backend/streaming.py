@@ -0,0 +1,326 @@
+from strauss.sonification import Sonification
+from strauss.stream import Stream
+from strauss.utilities import const_or_evo, nested_dict_idx_reassign
+from pathlib import Path
+import numpy as np
+from importlib.metadata import version
+import asyncio, aiofiles, struct, time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds of audio to render before writing a block out
+BLOCK_SECONDS = 2.
+
+# How long a reader waits for a stalled render before giving up
+STALL_TIMEOUT_SECONDS = 60.
+
+WAV_HEADER_BYTES = 44
+
+# Sonifications whose sources start at different times, so blocks can be finished before the whole render.
+# Light curves are played by Objects that all last the whole sonification, so they can't be streamed.
+STREAMING_CATEGORIES = ('constellations', 'night_sky')
+
+# render_blocks() follows the render loop of this strauss version (pinned in pyproject.toml),
+# other versions fall back to Sonification.render()
+STRAUSS_VERSION = '1.0.1'
+
+
+def partial_marker(filepath: Path) -> Path:
+    """Get the path of the marker file that exists while filepath is still being rendered."""
+    return filepath.with_name(f'.{filepath.name}.partial')
+
+
+def is_rendering(filepath: Path) -> bool:
+    return partial_marker(filepath).exists()
+
+
+def begin_stream(filepath: Path):
+    """
+    Mark filepath as being rendered and create it empty, so it can be requested before rendering starts.
+    """
+    partial_marker(filepath).touch()
+
+    # Unlink rather than truncate, the existing file may be hardlinked to a cached render
+    filepath.unlink(missing_ok=True)
+    filepath.touch()
+
+
+def end_stream(filepath: Path):
+    partial_marker(filepath).unlink(missing_ok=True)
+
+
+def wav_header(n_frames: int, n_channels: int, samprate: int) -> bytes:
+    """
+    Build the header of a 32-bit PCM WAV file, matching those written by Sonification.save().
+    """
+    bytes_per_sample = 4
+    block_align = n_channels * bytes_per_sample
+    data_size = n_frames * block_align
+
+    return (
+        b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, n_channels, samprate, samprate * block_align, block_align, 8 * bytes_per_sample)
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+
+def source_notes(soni: Sonification) -> tuple[np.ndarray, list[str]]:
+    """
+    Get the start time (as a fraction of the sonification) and note of each source, as Sonification.render() assigns them.
+    Sources without a time mapping are given one, starting at 0 and lasting the whole sonification.
+    """
+    sources = soni.sources
+    score = soni.score
+
+    if "time" not in sources.mapping:
+        sources.mapping['time'] = [0.] * sources.n_sources
+        sources.mapping['note_length'] = [score.length] * sources.n_sources
+
+    times = np.asarray(sources.mapping['time'], dtype=float)
+
+    # Index each chord
+    cbin = np.digitize(times, score.fracbins, 0)
+    cbin = np.clip(cbin-1, 0, score.nchords-1)
+
+    # Pitch rank of each source divided by the number of sources
+    pitchfrac = np.empty_like(sources.mapping['pitch'])
+    if score.pitch_binning == 'adaptive':
+        pitchfrac[np.argsort(sources.mapping['pitch'])] = np.arange(sources.n_sources)/sources.n_sources
+    elif score.pitch_binning == 'uniform':
+        pitchfrac = np.clip(sources.mapping['pitch'], 0, 9.999999e-1)
+
+    notes = []
+    for source in range(sources.n_sources):
+        chord = score.note_sequence[cbin[source]]
+        nints = score.nintervals[cbin[source]]
+        notes.append(chord[int(pitchfrac[source] * nints)])
+
+    return times, notes
+
+
+def peak_bound(soni: Sonification) -> float:
+    """
+    Estimate the loudest peak of a sonification before rendering it, as the largest sum of the peaks of the notes
+    sounding at once. Each note's peak is that of its note played once at full volume, scaled by the source's volume.
+
+    As notes rarely peak together this is usually well above the real peak, so audio normalised against it
+    is quieter than the finished render, but its level doesn't change as the render goes on.
+    """
+    sources = soni.sources
+    generator = soni.generator
+    Nsamp = soni.out_channels['0'].values.size
+
+    times, notes = source_notes(soni)
+
+    # Peak and length of each note at full volume
+    reference = {}
+    for note in set(notes):
+        sstream = generator.play({'note': note, 'volume': 1.})
+        reference[note] = (np.abs(sstream.values).max(), sstream.values.size)
+
+    steps = []
+    for source, note in enumerate(notes):
+        sourcemap = {}
+        nested_dict_idx_reassign(sources.mapping, sourcemap, source)
+
+        peak, playlen = reference[note]
+        volume = np.max(np.abs(sourcemap.get('volume', generator.preset['volume'])))
+
+        # Mapped note lengths change how long the note sounds for, as in Generator.play()
+        note_length = sourcemap.get('note_length', 'sample')
+        if note_length != 'sample':
+            release = sourcemap.get('volume_envelope/R', generator.preset['volume_envelope']['R'])
+            playlen = int((note_length + release) * soni.samprate)
+
+        start = int(Nsamp * times[source])
+        steps += [(start, peak * volume), (start + playlen, -peak * volume)]
+
+    # Notes ending at a sample are taken off before those starting there are added
+    level = bound = 0.
+    for _, change in sorted(steps, key=lambda step: (step[0], step[1] > 0)):
+        level += change
+        bound = max(bound, level)
+
+    return float(bound)
+
+
+def render_blocks(soni: Sonification, block_seconds: float = BLOCK_SECONDS):
+    """
+    Render a sonification like Sonification.render(), but playing sources in order of start time
+    and yielding each block of output samples as soon as no later source can add to it.
+
+    Sources that all start together (e.g. the Objects used for light curves) can only be finished
+    together, so these are yielded as a single block once rendered, which is why only STREAMING_CATEGORIES
+    are streamed. So are sonifications with a caption, or rendered by a strauss version other than
+    STRAUSS_VERSION, which use Sonification.render() instead.
+
+    Args:
+        soni: The sonification to render
+        block_seconds: Minimum length of each block
+
+    Yields:
+        (start, end) sample indices of the output channels that are finished
+    """
+    Nsamp = soni.out_channels['0'].values.size
+
+    if version('strauss') != STRAUSS_VERSION or str(soni.caption or '').strip():
+        soni.render()
+        yield 0, Nsamp
+        return
+
+    sources = soni.sources
+    times, notes = source_notes(soni)
+
+    lastsamp = Nsamp - 1
+    Nchan = len(soni.out_channels.keys())
+    block_samples = int(block_seconds * soni.samprate)
+
+    order = np.argsort(times, kind='stable')
+    start_samps = (Nsamp * times[order]).astype(int)
+    emitted = 0
+
+    for i, source in enumerate(order):
+
+        # Index note properties
+        tsamp = start_samps[i]
+
+        sourcemap = {}
+        nested_dict_idx_reassign(sources.mapping, sourcemap, source)
+        sourcemap['note'] = notes[source]
+
+        # Run generator to play the note
+        sstream = soni.generator.play(sourcemap)
+        playlen = sstream.values.size
+
+        if 'phi' in sourcemap:
+            azi = const_or_evo(sourcemap['phi'], sstream.sampfracs) * 2 * np.pi
+        elif 'azimuth' in sourcemap:
+            azi = const_or_evo(sourcemap['azimuth'], sstream.sampfracs) * 2 * np.pi
+        else:
+            azi = const_or_evo(soni.generator.preset['azimuth'], sstream.sampfracs) * 2 * np.pi
+        if 'theta' in sourcemap:
+            polar = const_or_evo(sourcemap['theta'], sstream.sampfracs) * np.pi
+        elif 'polar' in sourcemap:
+            polar = const_or_evo(sourcemap['polar'], sstream.sampfracs) * np.pi
+        else:
+            polar = const_or_evo(soni.generator.preset['polar'], sstream.sampfracs) * np.pi
+
+        # Truncate notes overshooting the sonification length
+        trunc_note = min(playlen, lastsamp-tsamp)
+        trunc_soni = trunc_note + tsamp
+
+        # Spatialise audio by computing relative volume in each speaker
+        for c in range(Nchan):
+            panenv = soni.channels.mics[c].antenna(azi, polar)
+            soni.out_channels[str(c)].values[tsamp:trunc_soni] += (sstream.values*panenv)[:trunc_note]
+
+        # Nothing played after this can start before the next source does
+        ready = start_samps[i+1] if i+1 < len(order) else Nsamp
+        ready = int(np.clip(ready, 0, Nsamp))
+
+        if ready - emitted >= block_samples:
+            yield emitted, ready
+            emitted = ready
+
+    if emitted < Nsamp:
+        yield emitted, Nsamp
+
+    # No captions are used, but Sonification.save() expects them
+    soni.caption_channels = {str(c): Stream(0, soni.samprate) for c in range(Nchan)}
+
+
+def save_streaming(soni: Sonification, filepath: Path, master_volume: float = 1., block_seconds: float = BLOCK_SECONDS):
+    """
+    Render a sonification straight into a WAV file, writing each block as soon as it is finished.
+
+    The header is written first with the final length, so players can start on a partially written file.
+    The loudest peak isn't known until the end, so blocks are normalised against peak_bound() instead,
+    which keeps the level steady but quieter than Sonification.save() would. Once rendered, the
+    file can be replaced with a normalised copy.
+
+    Args:
+        soni: The (not yet rendered) sonification
+        filepath: File to write, created beforehand with begin_stream() and ended afterwards with end_stream()
+        master_volume: Amplitude of the largest volume peak, from 0-1
+        block_seconds: Minimum length of each block
+    """
+    Nchan = len(soni.out_channels)
+    Nsamp = soni.out_channels['0'].values.size
+
+    full_scale = pow(2, 31)-1
+    vmax = peak_bound(soni) * 1.05
+    norm = master_volume * full_scale / vmax if vmax else 0.
+
+    # Write into the existing file (rather than replacing it) so readers already following it see the data
+    with open(filepath, 'r+b') as f:
+        f.write(wav_header(Nsamp, Nchan, soni.samprate))
+        f.flush()
+
+        for start, end in render_blocks(soni, block_seconds):
+            block = np.column_stack([soni.out_channels[str(c)].values[start:end] for c in range(Nchan)])
+
+            # The bound is an estimate, so clip rather than wrap around if a peak ever exceeds it
+            f.write(np.clip(block * norm, -full_scale, full_scale).astype('<i4').tobytes())
+            f.flush()
+
+
+async def follow_file(filepath: Path, chunk_size: int = 64 * 1024, poll_seconds: float = 0.1):
+    """
+    Read a file that is still being rendered, yielding chunks as they are written until the render ends.
+    Waits on the event loop rather than a thread, so a slow render doesn't tie up the threadpool.
+
+    Args:
+        filepath: File being written by save_streaming()
+        chunk_size: Maximum bytes per chunk
+        poll_seconds: Time to wait between checks for new data
+
+    Yields:
+        Chunks of the file contents
+    """
+    last_data = time.monotonic()
+
+    async with aiofiles.open(filepath, 'rb') as f:
+        while True:
+            chunk = await f.read(chunk_size)
+
+            if chunk:
+                last_data = time.monotonic()
+                yield chunk
+                continue
+
+            if not is_rendering(filepath):
+                # Render finished, send anything written since the last read
+                while chunk := await f.read(chunk_size):
+                    yield chunk
+                return
+
+            if time.monotonic() - last_data > STALL_TIMEOUT_SECONDS:
+                logger.warning(f"Gave up following {filepath.name}, no data for {STALL_TIMEOUT_SECONDS}s")
+                return
+
+            await asyncio.sleep(poll_seconds)
+
+
+async def expected_size(filepath: Path, timeout_seconds: float = STALL_TIMEOUT_SECONDS) -> int | None:
+    """
+    Get the final size of a WAV file being rendered, from its header.
+
+    Returns:
+        Size in bytes, or None if the header wasn't written in time
+    """
+    deadline = time.monotonic() + timeout_seconds
+
+    while time.monotonic() < deadline:
+        async with aiofiles.open(filepath, 'rb') as f:
+            header = await f.read(WAV_HEADER_BYTES)
+
+        if len(header) == WAV_HEADER_BYTES:
+            return struct.unpack('<I', header[4:8])[0] + 8
+
+        if not is_rendering(filepath):
+            return None
+
+        await asyncio.sleep(0.1)
+
+    return None
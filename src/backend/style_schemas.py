@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, field_validator, model_validator
-from typing import Optional, Dict, List, Union, Tuple
+from typing import Optional, Dict, List, Union, Tuple, Literal
 from paths import *
 from strauss.sources import param_lim_dict
 from pychord import Chord
@@ -69,6 +69,7 @@ class BaseStyle(BaseModel):
     mods: Optional[Dict] = Field(None)
     parameters: List[ParameterMapping] = Field(...)
     harmony: Union[str, List, None] = Field(None)
+    downsampling: Optional[Literal['mean', 'minmax', 'lttb']] = Field(None)
 
     @field_validator('sound')
     @classmethod
@@ -0,0 +1,42 @@
+from cache import FileCache
+import os, time
+
+
+def test_fetch_leaves_linked_copies_alone(tmp_path):
+    cache = FileCache(tmp_path / 'cache', max_bytes=1024)
+
+    src = tmp_path / 'src.txt'
+    src.write_bytes(b'x' * 100)
+    cache.store('a', src)
+
+    session_copy = tmp_path / 'session.txt'
+    assert cache.fetch('a', session_copy)
+    mtime = session_copy.stat().st_mtime_ns
+
+    time.sleep(0.01)
+    assert cache.fetch('a', tmp_path / 'other_session.txt')
+
+    # Data caches are keyed by mtime, so another session linking the file mustn't change it
+    assert session_copy.stat().st_mtime_ns == mtime
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = FileCache(tmp_path / 'cache', max_bytes=250)
+
+    for key in ('a', 'b'):
+        src = tmp_path / key
+        src.write_bytes(b'x' * 100)
+        cache.store(key, src)
+        time.sleep(0.01)
+
+    # Using 'a' makes 'b' the least recently used
+    assert cache.lookup('a') is not None
+
+    src = tmp_path / 'c'
+    src.write_bytes(b'x' * 100)
+    time.sleep(0.01)
+    cache.store('c', src)
+
+    assert cache.lookup('a') is not None
+    assert cache.lookup('b') is None
+    assert not os.path.exists(cache.used_marker(cache.path_for('b')))
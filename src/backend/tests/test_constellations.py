@@ -0,0 +1,86 @@
+from star_catalog import StarCatalog
+import constellations
+from constellations import ConstellationStars, get_constellation, CONST_STARS, IAU_names
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def old_constellation_center(df):
+    """constellation_center() as it was before ConstellationStars, for comparison."""
+    ra = df["ra"].copy()
+    dec = df["dec"]
+
+    if ra.max() - ra.min() > 12:
+        ra[ra < 12] += 24
+
+    ra_center = (ra.min() + ra.max()) / 2
+    dec_center = (dec.min() + dec.max()) / 2
+
+    return (ra_center % 24) * 15, dec_center
+
+
+def synthetic_catalog(seed: int = 0) -> pd.DataFrame:
+    """
+    Stars for the shapes of Pegasus and Andromeda, with more inside their boundaries,
+    spread either side of the 0h RA line as the real constellations are.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+
+    for name in ('Pegasus', 'Andromeda', 'Orion'):
+        con = IAU_names[name]
+        hips = CONST_STARS[con]
+        n = len(hips) + 60
+
+        # Orion doesn't cross 0h
+        ra = rng.uniform(4.8, 6.2, n) if name == 'Orion' else rng.uniform(-2.5, 1.5, n) % 24
+
+        frames.append(pd.DataFrame({
+            'hip': np.concatenate((hips, np.full(n - len(hips), np.nan))),
+            'con': con,
+            'ra': ra,
+            'dec': rng.uniform(-10, 50, n),
+            'magnitude': rng.uniform(-1, 8, n),
+        }))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    stars = synthetic_catalog()
+    monkeypatch.setattr(constellations, 'get_catalog', lambda: StarCatalog(stars, ('synthetic',)))
+
+    return stars
+
+
+@pytest.mark.parametrize('name', ['Pegasus', 'Andromeda', 'Orion'])
+@pytest.mark.parametrize('by_shape', [True, False])
+def test_constellation_stars_match_pandas(catalog, name, by_shape):
+
+    con = IAU_names[name]
+    in_constellation = catalog[catalog['hip'].isin(CONST_STARS[con])] if by_shape else catalog[catalog['con'] == con]
+    expected = in_constellation.sort_values('magnitude')
+
+    stars = ConstellationStars(get_constellation(name, by_shape))
+
+    assert len(stars) == len(expected)
+    assert np.isclose(stars.center(), old_constellation_center(expected)).all()
+
+    for n in (1, 2, 5, len(expected) // 2, len(expected), len(expected) + 10):
+        top = expected.head(n)
+
+        np.testing.assert_array_equal(stars.top(n)['magnitude'], top['magnitude'])
+        assert stars.max_magnitude(n) == max(top['magnitude'].tolist())
+        np.testing.assert_allclose(stars.center(n), old_constellation_center(top))
+
+    for max_magnitude in (-2, 0.5, 3, stars.max_magnitude(7), 10):
+        assert stars.count_brighter(max_magnitude) == len(expected[expected['magnitude'] <= max_magnitude])
+
+
+def test_pegasus_crosses_0h(catalog):
+    ra, _ = ConstellationStars(get_constellation('Pegasus', by_shape=False)).center()
+
+    # Halfway between about 22h and 1.5h, not in the middle of the sky
+    assert ra < 15 or ra > 300
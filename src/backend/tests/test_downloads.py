@@ -0,0 +1,106 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from fastapi import HTTPException
+from cache import FileCache
+import downloads
+import asyncio, threading, time
+import pytest
+
+
+BODY = b'light curve' * 1000
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves /file slowly (counting requests), /big with a length over the limit and /hang never."""
+
+    hits = 0
+
+    def do_GET(self):
+
+        if self.path == '/file':
+            Handler.hits += 1
+            time.sleep(0.2)
+            self.reply(BODY)
+
+        elif self.path == '/big':
+            self.send_response(200)
+            self.send_header('Content-Length', str(2 * 1024 * 1024))
+            self.end_headers()
+
+        elif self.path == '/hang':
+            # Outlasts the client's timeout, which has hung up by the time this returns
+            time.sleep(1)
+
+        else:
+            self.send_error(404)
+
+    def reply(self, body: bytes):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.hits = 0
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return FileCache(tmp_path / 'downloads', max_bytes=16 * 1024 * 1024)
+
+
+def run(coro):
+    """Run a coroutine, closing the pooled client after, as it can't outlive its event loop."""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await downloads.close_client()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_downloads_share_one_request(server, cache):
+
+    async def download_three_times():
+        return await asyncio.gather(*(downloads.download_to_cache(cache, 'file', f'{server}/file') for _ in range(3)))
+
+    paths = run(download_three_times())
+
+    assert Handler.hits == 1
+    assert len(set(paths)) == 1
+    assert paths[0].read_bytes() == BODY
+
+    # Nothing left behind but the cached file
+    assert [p.name for p in cache.cache_dir.iterdir() if not p.name.endswith('.used')] == ['file']
+
+
+def test_download_over_limit(server, cache, monkeypatch):
+    monkeypatch.setattr(downloads, 'DOWNLOAD_MAX_MB', 1)
+
+    with pytest.raises(HTTPException) as e:
+        run(downloads.download_to_cache(cache, 'big', f'{server}/big'))
+
+    assert e.value.status_code == 413
+    assert list(cache.cache_dir.iterdir()) == []
+
+
+def test_download_timeout(server, cache, monkeypatch):
+    monkeypatch.setattr(downloads, 'DOWNLOAD_TIMEOUT_SECONDS', 0.2)
+
+    with pytest.raises(HTTPException) as e:
+        run(downloads.download_to_cache(cache, 'hang', f'{server}/hang'))
+
+    assert e.value.status_code == 504
+    assert list(cache.cache_dir.iterdir()) == []
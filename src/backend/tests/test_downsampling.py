@@ -0,0 +1,190 @@
+from downsampling import downsample, decimate_for_plot, resample, absolute_lims, DOWNSAMPLING_MODES
+from strauss.sources import Objects
+import strauss.sources
+import numpy as np
+import pytest
+
+
+def light_curve(n: int = 1000, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """A noisy sine wave with a transit-like dip."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 10, n)
+    y = np.sin(x) + rng.normal(0, 0.05, n)
+    y[400:420] -= 3
+
+    return x, y
+
+
+@pytest.mark.parametrize('mode', DOWNSAMPLING_MODES)
+def test_downsample_reduces_to_n_out(mode):
+    x, y = light_curve()
+
+    new_x, new_y = downsample(x, y, 100, mode)
+
+    assert new_x.size == new_y.size == 100
+    assert np.all(np.diff(new_x) >= 0)
+
+
+def test_downsample_minmax_keeps_extremes():
+    x, y = light_curve()
+
+    new_x, new_y = downsample(x, y, 100, 'minmax')
+
+    assert new_y.min() == y.min()
+    assert new_y.max() == y.max()
+
+
+def test_downsample_lttb_keeps_dip_and_ends():
+    x, y = light_curve()
+
+    new_x, new_y = downsample(x, y, 100, 'lttb')
+
+    assert new_x[0] == x[0] and new_x[-1] == x[-1]
+    assert new_y.min() < -2
+
+
+def test_downsample_mean_averages_bins():
+    x = np.arange(10.)
+    y = np.arange(10.)
+
+    new_x, new_y = downsample(x, y, 5, 'mean')
+
+    np.testing.assert_array_equal(new_y, [0.5, 2.5, 4.5, 6.5, 8.5])
+    np.testing.assert_array_equal(new_x, np.linspace(0, 9, 5))
+
+
+@pytest.mark.parametrize('mode', DOWNSAMPLING_MODES)
+def test_downsample_short_series_unchanged(mode):
+    x, y = light_curve(50)
+
+    new_x, new_y = downsample(x, y, 100, mode)
+
+    np.testing.assert_array_equal(new_x, x)
+    np.testing.assert_array_equal(new_y, y)
+
+
+@pytest.mark.parametrize('mode', DOWNSAMPLING_MODES)
+def test_downsample_to_nothing(mode):
+    x, y = light_curve()
+
+    new_x, new_y = downsample(x, y, 0, mode)
+
+    assert new_x.size == new_y.size == 0
+
+
+def test_downsample_unknown_mode():
+    x, y = light_curve()
+
+    with pytest.raises(ValueError):
+        downsample(x, y, 100, 'median')
+
+
+def test_decimate_for_plot_keeps_column_extremes():
+    x, y = light_curve(10000)
+    n_columns = 50
+
+    new_x, new_y = decimate_for_plot(x, y, n_columns)
+
+    assert new_y.size <= 4 * n_columns
+    assert new_x[0] == x[0] and new_x[-1] == x[-1]
+
+    # Each pixel column keeps its minimum and maximum, so the plotted line spans the same values
+    columns = np.minimum((x - x[0]) / (x[-1] - x[0]) * n_columns, n_columns - 1).astype(int)
+    new_columns = np.minimum((new_x - x[0]) / (x[-1] - x[0]) * n_columns, n_columns - 1).astype(int)
+
+    for column in range(n_columns):
+        assert new_y[new_columns == column].min() == y[columns == column].min()
+        assert new_y[new_columns == column].max() == y[columns == column].max()
+
+
+def test_decimate_for_plot_keeps_breaks():
+    x, y = light_curve(10000)
+    y[5000:5100] = np.nan
+
+    new_x, new_y = decimate_for_plot(x, y, 50)
+
+    # One break, where the gap was
+    gaps = np.flatnonzero(np.isnan(new_y))
+    assert gaps.size == 1
+    assert new_x[gaps[0] - 1] < x[5000] and new_x[gaps[0] + 1] > x[5099]
+
+
+def test_decimate_for_plot_short_or_unsorted_unchanged():
+    x, y = light_curve(100)
+
+    new_x, new_y = decimate_for_plot(x, y, 50)
+    np.testing.assert_array_equal(new_y, y)
+
+    x, y = light_curve(10000)
+    new_x, new_y = decimate_for_plot(x[::-1], y, 50)
+    np.testing.assert_array_equal(new_y, y)
+
+
+def test_decimate_for_plot_to_nothing():
+    x, y = light_curve()
+
+    new_x, new_y = decimate_for_plot(x, y, 0)
+
+    assert new_x.size == new_y.size == 0
+
+
+@pytest.mark.parametrize('mode', DOWNSAMPLING_MODES)
+def test_downsample_drops_nans(mode):
+    x, y = light_curve()
+    y[100:150] = np.nan
+
+    new_x, new_y = downsample(x, y, 100, mode)
+
+    assert new_x.size == new_y.size == 100
+    assert np.all(np.isfinite(new_y))
+
+
+@pytest.mark.parametrize('n_out', [1, 2, 3, 101])
+def test_downsample_minmax_caps_at_n_out(n_out):
+    x, y = light_curve()
+
+    new_x, new_y = downsample(x, y, n_out, 'minmax')
+
+    assert 0 < new_y.size <= n_out
+
+
+RESCALE_VALUES = strauss.sources.rescale_values
+
+
+def mapped_lims(data: dict, m_lims: dict, funcs: dict, monkeypatch) -> list[tuple]:
+    """Map data to Objects as light curves are, recording the limits strauss rescales each parameter from."""
+    recorded = []
+
+    def spy(values, lims, plims):
+        recorded.append(tuple(float(lim) for lim in lims))
+        return RESCALE_VALUES(values, lims, plims)
+
+    monkeypatch.setattr(strauss.sources, 'rescale_values', spy)
+
+    sources = Objects(data.keys())
+    sources.fromdict(data)
+    sources.apply_mapping_functions(map_funcs=funcs, map_lims=m_lims)
+
+    return recorded
+
+
+def test_absolute_lims_survive_resampling(monkeypatch):
+    x, y = light_curve(20000)
+    n_control = 500
+
+    funcs = {'pitch_shift': lambda v: np.negative(v)}
+    m_lims = {'time_evo': ('0%', '100%'), 'pitch_shift': ('5%', '105%'), 'volume': ('10%', 0.5)}
+
+    full = {'pitch': [0, 1], 'time_evo': [x, x], 'pitch_shift': [y, y], 'volume': [y, y]}
+    expected = mapped_lims(full, m_lims, funcs, monkeypatch)
+
+    # As light_curve_sources() does for long light curves
+    evolving = ['time_evo', 'pitch_shift', 'volume']
+    abs_lims = {key: absolute_lims(full[key][0], m_lims[key], funcs.get(key)) for key in evolving}
+    resampled = resample(x, {key: full[key][0] for key in evolving}, n_control)
+    data = {'pitch': [0, 1], **{key: [resampled[key]] * 2 for key in evolving}}
+
+    np.testing.assert_allclose(mapped_lims(data, abs_lims, funcs, monkeypatch), expected)
+
+    # Percentiles of the resampled data itself would differ, as resampling smooths the noise
+    assert not np.allclose(mapped_lims(data, m_lims, funcs, monkeypatch), expected)
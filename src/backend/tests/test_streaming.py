@@ -0,0 +1,79 @@
+from strauss.sonification import Sonification
+from strauss.sources import Events, Objects
+from strauss.score import Score
+from strauss.generator import Synthesizer
+from streaming import render_blocks, save_streaming, begin_stream, peak_bound, WAV_HEADER_BYTES
+import numpy as np
+import pytest
+
+
+def events_sonification(seed: int = 0) -> Sonification:
+    """Notes starting at random times, as for constellations."""
+    rng = np.random.default_rng(seed)
+    n = 40
+
+    sources = Events(['time', 'pitch', 'volume'])
+    sources.fromdict({'time': rng.uniform(0, 1, n), 'pitch': rng.uniform(0, 1, n), 'volume': rng.uniform(0.2, 1, n)})
+    sources.apply_mapping_functions(map_lims={'time': ('0%', '110%')})
+
+    return Sonification(Score([['C3', 'E3', 'G3']], 6), sources, Synthesizer(samprate=8000), 'stereo', samprate=8000)
+
+
+def objects_sonification(seed: int = 0) -> Sonification:
+    """Continuous sources that all start together, as for light curves."""
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 1, 500)
+
+    sources = Objects(['pitch', 'time_evo', 'pitch_shift'])
+    sources.fromdict({'pitch': [0, 1], 'time_evo': [t, t], 'pitch_shift': [rng.uniform(0, 1, t.size)] * 2})
+    sources.apply_mapping_functions(map_lims={'time_evo': ('0%', '100%'), 'pitch_shift': ('0%', '100%')})
+
+    return Sonification(Score([['C3', 'G3']], 4), sources, Synthesizer(samprate=8000), 'mono', samprate=8000)
+
+
+@pytest.mark.parametrize('make_sonification', [events_sonification, objects_sonification])
+def test_render_blocks_matches_render(make_sonification):
+
+    expected = make_sonification()
+    expected.render()
+
+    streamed = make_sonification()
+    blocks = list(render_blocks(streamed, block_seconds=0.5))
+
+    # Blocks cover the output in order, without gaps
+    assert blocks[0][0] == 0
+    assert blocks[-1][1] == streamed.out_channels['0'].values.size
+    assert all(end == next_start for (_, end), (next_start, _) in zip(blocks, blocks[1:]))
+
+    for c in expected.out_channels:
+        np.testing.assert_allclose(streamed.out_channels[c].values, expected.out_channels[c].values)
+        assert streamed.caption_channels[c].values.size == expected.caption_channels[c].values.size
+
+
+def test_render_blocks_yields_events_early():
+
+    blocks = list(render_blocks(events_sonification(), block_seconds=0.5))
+
+    assert len(blocks) > 1
+
+
+def test_save_streaming_keeps_a_steady_level(tmp_path):
+
+    expected = events_sonification()
+    expected.render()
+    rendered = np.column_stack([expected.out_channels[c].values for c in sorted(expected.out_channels)])
+
+    filepath = tmp_path / 'streamed.wav'
+    begin_stream(filepath)
+    save_streaming(events_sonification(), filepath, block_seconds=0.5)
+
+    data = filepath.read_bytes()
+    streamed = np.frombuffer(data[WAV_HEADER_BYTES:], dtype='<i4').reshape(rendered.shape)
+
+    # Every block is scaled by the same gain, which leaves room for the real peak
+    loud = np.abs(rendered) > 1e-3 * np.abs(rendered).max()
+    gain = streamed[loud] / rendered[loud]
+    np.testing.assert_allclose(gain, np.median(gain), rtol=1e-3)
+    assert np.abs(streamed).max() < pow(2, 31) - 1
+
+    assert peak_bound(events_sonification()) >= np.abs(rendered).max()